@@ -0,0 +1,432 @@
+import os
+import json
+import glob
+import shutil
+import socket
+import argparse
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import random
+import logging
+import multiprocessing
+from typing import Dict, List, Optional
+import psycopg2
+from Loader import DataMigration
+from helper.IdIndex import IdIndex
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class LocalPostgres:
+    """
+    Throwaway PostgreSQL cluster created with initdb in a temporary directory.
+    It only listens on a Unix socket inside that directory and is removed when stopped.
+    """
+
+    def __init__(self, directory: str, server_options: Optional[List[str]] = None):
+        self.directory = directory
+        self.data_directory = os.path.join(directory, 'data')
+        self.socket_directory = directory
+        self.server_options = server_options or []
+        self.port = self._free_port()
+
+    @staticmethod
+    def _free_port() -> int:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    @staticmethod
+    def find_binary(name: str) -> str:
+        """
+        Finds a PostgreSQL server binary on the PATH or in the usual installation directories.
+        """
+        path = shutil.which(name)
+        if path:
+            return path
+        candidates = sorted(glob.glob(f'/usr/lib/postgresql/*/bin/{name}') + glob.glob(f'/usr/pgsql-*/bin/{name}')
+                            + glob.glob(f'/usr/local/pgsql/bin/{name}'))
+        if not candidates:
+            raise FileNotFoundError(f"PostgreSQL binary {name} not found, install the PostgreSQL server")
+        return candidates[-1]
+
+    def start(self):
+        subprocess.run([self.find_binary('initdb'), '-D', self.data_directory, '-A', 'trust', '-U', 'postgres',
+                        '-E', 'UTF8', '--no-sync'], check=True, stdout=subprocess.DEVNULL)
+        options = [f"-p {self.port}", f"-k {self.socket_directory}", "-c listen_addresses=''"]
+        options += [f"-c {option}" for option in self.server_options]
+        subprocess.run([self.find_binary('pg_ctl'), '-D', self.data_directory, '-w', '-l',
+                        os.path.join(self.directory, 'server.log'), '-o', ' '.join(options), 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+
+    def stop(self):
+        subprocess.run([self.find_binary('pg_ctl'), '-D', self.data_directory, '-m', 'fast', 'stop'],
+                       check=False, stdout=subprocess.DEVNULL)
+
+    def credentials(self, db: str) -> Dict:
+        return {"host": self.socket_directory, "port": self.port, "db": db, "user": "postgres", "password": ""}
+
+    def connect(self, db: str = 'postgres'):
+        credentials = self.credentials(db)
+        return psycopg2.connect(host=credentials["host"], port=credentials["port"], dbname=db,
+                                user=credentials["user"], password=credentials["password"])
+
+    def recreate_database(self, db: str):
+        conn = self.connect()
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS "{db}"')
+            cursor.execute(f'CREATE DATABASE "{db}"')
+        conn.close()
+
+    def version(self) -> str:
+        conn = self.connect()
+        with conn.cursor() as cursor:
+            cursor.execute("SHOW server_version")
+            version = cursor.fetchone()[0]
+        conn.close()
+        return version
+
+
+class SyntheticSchema:
+    """
+    Old and new tables shaped after the mapping files, filled with generated rows.
+    Column types come from the Odoo field types of the mapping when present and are
+    guessed from Odoo naming conventions otherwise. Rows are generated by the server
+    with generate_series, so millions of rows are created in seconds.
+    """
+
+    FIELD_TYPES = {
+        'integer': 'int4', 'many2one': 'int4', 'float': 'float8', 'monetary': 'numeric', 'boolean': 'bool',
+        'date': 'date', 'datetime': 'timestamp', 'char': 'varchar', 'text': 'text', 'html': 'text',
+        'selection': 'varchar', 'binary': 'bytea',
+    }
+    NUMERIC_NAMES = ('amount', 'price', 'balance', 'debit', 'credit', 'qty', 'quantity', 'discount', 'rate')
+
+    def __init__(self, null_ratio: float = 0.2, text_length: int = 24, seed: float = 0.42):
+        self.null_ratio = null_ratio
+        self.text_length = text_length
+        self.seed = seed
+
+    def column_type(self, name: str, field_type: Optional[str] = None) -> str:
+        if field_type and field_type.lower() in self.FIELD_TYPES:
+            return self.FIELD_TYPES[field_type.lower()]
+        if name == 'id' or name.endswith('_id') or name.endswith('_uid') or name == 'sequence':
+            return 'int4'
+        if name in ('create_date', 'write_date', '__last_update') or name.endswith('_datetime'):
+            return 'timestamp'
+        if name == 'date' or name.startswith('date_') or name.endswith('_date'):
+            return 'date'
+        if name == 'active' or name.startswith('is_') or name.startswith('has_'):
+            return 'bool'
+        if any(part in name for part in self.NUMERIC_NAMES):
+            return 'numeric'
+        return 'varchar'
+
+    def value_expression(self, column: str, column_type: str) -> str:
+        """
+        Returns the SQL expression generating the values of a column, NULL for null_ratio of the rows.
+        """
+        if column == 'id':
+            return 'g'
+        expressions = {
+            'int4': "(1 + random() * 1000)::int4",
+            'float8': "random() * 10000",
+            'numeric': "round((random() * 10000)::numeric, 2)",
+            'bool': "random() < 0.5",
+            'date': "date '2015-01-01' + (random() * 3000)::int4",
+            'timestamp': "timestamp '2015-01-01' + random() * interval '3000 days'",
+            'bytea': "decode(md5(random()::text), 'hex')",
+        }
+        repeats = self.text_length // 32 + 1
+        expression = expressions.get(column_type,
+                                     f"substr(repeat(md5(random()::text), {repeats}), 1, {self.text_length})")
+        return f"CASE WHEN random() < {self.null_ratio} THEN NULL ELSE {expression} END"
+
+    def table_columns(self, mappings: List[Dict]) -> (Dict, Dict):
+        """
+        Collects the columns of the old and new tables of the mappings, keyed by table name.
+        """
+        old_tables = {}
+        new_tables = {}
+        for mapping in mappings:
+            old_columns = old_tables.setdefault(mapping['old_model'].replace('.', '_'), {'id': 'int4'})
+            new_columns = new_tables.setdefault(mapping['new_model'].replace('.', '_'), {'id': 'int4'})
+            for field in mapping['field_mappings']:
+                old_columns.setdefault(field['field_name_old'],
+                                       self.column_type(field['field_name_old'], field.get('field_type_old')))
+                new_columns.setdefault(field['field_name_new'],
+                                       self.column_type(field['field_name_new'], field.get('field_type_new')))
+            for column in mapping['defaults']:
+                new_columns.setdefault(column, 'varchar')
+        return old_tables, new_tables
+
+    def create(self, old_conn, new_conn, mappings: List[Dict], rows: int):
+        """
+        Creates the old and new tables of the mappings and fills the old ones with `rows` rows each.
+        """
+        old_tables, new_tables = self.table_columns(mappings)
+        for conn, tables in ((old_conn, old_tables), (new_conn, new_tables)):
+            with conn.cursor() as cursor:
+                for table, columns in tables.items():
+                    definitions = ', '.join(f'"{column}" {column_type}' + (' PRIMARY KEY' if column == 'id' else '')
+                                            for column, column_type in columns.items())
+                    cursor.execute(f'CREATE TABLE "{table}" ({definitions})')
+            conn.commit()
+        with old_conn.cursor() as cursor:
+            cursor.execute("SELECT setseed(%s)", (self.seed,))
+            for table, columns in old_tables.items():
+                names = ', '.join(f'"{column}"' for column in columns)
+                expressions = ', '.join(self.value_expression(column, column_type)
+                                        for column, column_type in columns.items())
+                cursor.execute(f'INSERT INTO "{table}" ({names}) SELECT {expressions} FROM generate_series(1, %s) g',
+                               (rows,))
+                cursor.execute(f'ANALYZE "{table}"')
+        old_conn.commit()
+        logging.info(f"Generated {rows} rows in {', '.join(old_tables)}")
+
+
+def run_migration(connection_file: str, models_xml_directory: str, mapping_directory: str, loader_options: Dict,
+                  report_path: str, results):
+    """
+    Runs the loader in a child process, so its peak RSS can be measured on its own.
+    """
+    dm = DataMigration(connection_file, models_xml_directory, mapping_directory, report_path=report_path,
+                       **loader_options)
+    dm.migrate()
+    results.put(max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+
+
+class Benchmark:
+    """
+    Runs the loader end to end on synthetic data and stores the results per commit,
+    one JSON file per commit in the results directory.
+    """
+
+    def __init__(self, mapping_directory: str, results_directory: str):
+        self.mapping_directory = mapping_directory
+        self.results_directory = results_directory
+
+    @staticmethod
+    def git_revision() -> (str, bool):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                    check=True).stdout.strip()
+            dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                        capture_output=True, text=True, check=True).stdout.strip())
+            return commit, dirty
+        except (OSError, subprocess.CalledProcessError):
+            return 'unknown', False
+
+    def run(self, xml_names: List[str], sizes: List[int], schema: SyntheticSchema, loader_options: Dict,
+            server_options: Optional[List[str]] = None, keep: bool = False) -> List[Dict]:
+        """
+        Runs one benchmark per size, each on freshly generated databases.
+        Returns:
+            The results, also appended to the results file of the current commit.
+        """
+        commit, dirty = self.git_revision()
+        directory = tempfile.mkdtemp(prefix='migration_benchmark_')
+        server = LocalPostgres(directory, server_options)
+        results = []
+        try:
+            with open(os.path.join(directory, 'models.xml'), 'w') as file:
+                file.write('<models>\n' + ''.join(f'    <model><xml_name>{xml_name}</xml_name></model>\n'
+                                                  for xml_name in xml_names) + '</models>\n')
+            connection_file = os.path.join(directory, 'connection.json')
+            with open(connection_file, 'w') as file:
+                json.dump({'old_db': server.credentials('bench_old'), 'new_db': server.credentials('bench_new')}, file)
+            loader = DataMigration(connection_file, directory, self.mapping_directory)
+            mappings = [mapping for xml_name in xml_names for mapping in loader.get_model_mappings(xml_name) or []]
+            if not mappings:
+                raise ValueError(f"No mappings found for {xml_names}")
+            server.start()
+            for rows in sizes:
+                server.recreate_database('bench_old')
+                server.recreate_database('bench_new')
+                old_conn = server.connect('bench_old')
+                new_conn = server.connect('bench_new')
+                schema.create(old_conn, new_conn, mappings, rows)
+                old_conn.close()
+                new_conn.close()
+                report_path = os.path.join(directory, f'report_{rows}.json')
+                queue = multiprocessing.Queue()
+                started = time.perf_counter()
+                process = multiprocessing.Process(target=run_migration, args=(
+                    connection_file, directory, self.mapping_directory, loader_options, report_path, queue))
+                process.start()
+                process.join()
+                elapsed = time.perf_counter() - started
+                if process.exitcode != 0:
+                    raise RuntimeError(f"Migration of {rows} rows failed with exit code {process.exitcode}")
+                peak_rss = queue.get()
+                with open(report_path) as file:
+                    report = json.load(file)
+                stages = {}
+                for mapping in report['mappings']:
+                    for stage, seconds in mapping['seconds'].items():
+                        stages[stage] = round(stages.get(stage, 0.0) + seconds, 3)
+                result = {
+                    'commit': commit,
+                    'dirty': dirty,
+                    'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(),
+                    'postgres': server.version(),
+                    'scenario': {
+                        'mappings': xml_names,
+                        'rows': rows,
+                        'null_ratio': schema.null_ratio,
+                        'text_length': schema.text_length,
+                        'loader_options': loader_options,
+                    },
+                    'elapsed': round(elapsed, 3),
+                    'rows_written': report['rows_written'],
+                    'rows_failed': report['rows_failed'],
+                    'rows_per_second': round(report['rows_written'] / elapsed, 1),
+                    'peak_rss_kb': peak_rss,
+                    'stages': stages,
+                }
+                logging.info(f"{rows} rows: {result['rows_per_second']} rows/s, {elapsed:.1f}s, "
+                             f"peak RSS {peak_rss // 1024} MB, stages {stages}")
+                results.append(result)
+        finally:
+            server.stop()
+            if keep:
+                logging.info(f"Benchmark cluster kept in {directory}")
+            else:
+                shutil.rmtree(directory, ignore_errors=True)
+        self.save(commit, results)
+        return results
+
+    def results_file(self, commit: str) -> str:
+        return os.path.join(self.results_directory, f"{commit}.json")
+
+    def load(self, commit: str) -> List[Dict]:
+        try:
+            with open(self.results_file(commit)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return []
+
+    def save(self, commit: str, results: List[Dict]):
+        os.makedirs(self.results_directory, exist_ok=True)
+        with open(self.results_file(commit), 'w') as file:
+            json.dump(self.load(commit) + results, file, indent=2)
+
+    def compare(self, base_commit: str, commit: str):
+        """
+        Prints the throughput of the scenarios measured on both commits, using the latest result of each.
+        """
+        def latest(results):
+            return {json.dumps(result['scenario'], sort_keys=True): result for result in results}
+        base_results = latest(self.load(base_commit))
+        results = latest(self.load(commit))
+        print(f"{'scenario':60} {base_commit:>12} {commit:>12} {'ratio':>7} {'rss MB':>13}")
+        for scenario in sorted(base_results.keys() & results.keys()):
+            base, result = base_results[scenario], results[scenario]
+            ratio = result['rows_per_second'] / base['rows_per_second'] if base['rows_per_second'] else float('nan')
+            name = f"{','.join(result['scenario']['mappings'])} {result['scenario']['rows']} rows " \
+                   f"{json.dumps(result['scenario']['loader_options'], sort_keys=True)}"
+            print(f"{name[:60]:60} {base['rows_per_second']:>12} {result['rows_per_second']:>12} {ratio:>7.2f} "
+                  f"{base['peak_rss_kb'] // 1024:>6}/{result['peak_rss_kb'] // 1024:<6}")
+
+
+class TimedIdIndex(IdIndex):
+    """
+    IdIndex measuring the time spent moving pending ids to its sorted runs.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.flush_seconds = 0.0
+
+    def flush_pending(self):
+        started = time.perf_counter()
+        super().flush_pending()
+        self.flush_seconds += time.perf_counter() - started
+
+
+def check_id_index_scaling(sizes: List[int], max_growth: float = 4.0, seed: int = 42) -> bool:
+    """
+    Adds ids one by one to an empty IdIndex, as the loader does while inserting, for
+    ascending ids with gaps (a growing sparse table) and shuffled ids (records inserted
+    out of order). The time spent storing the pending ids in sorted runs, per id, may
+    only grow a little from the smallest size to the largest: merging the whole index
+    on every flush makes it grow with the size.
+    Args:
+        sizes: Numbers of ids added, one run each.
+        max_growth: Greatest allowed ratio of the cost per id of the largest size to the smallest.
+        seed: Seed of the shuffled ids.
+    Returns:
+        True when every pattern stays within max_growth.
+    """
+    random_generator = random.Random(seed)
+    patterns = {
+        'ascending': lambda size: range(0, size * 100, 100),
+        'shuffled': lambda size: random_generator.sample(range(size * 100), size),
+    }
+    passed = True
+    for name, generate in patterns.items():
+        costs = []
+        for size in sizes:
+            ids = list(generate(size))
+            index = TimedIdIndex()
+            started = time.perf_counter()
+            index.add_many(ids)
+            elapsed = time.perf_counter() - started
+            costs.append(index.flush_seconds / size)
+            logging.info(f"IdIndex {name} {size} ids: {elapsed:.2f}s, {index.flush_seconds:.2f}s storing runs, "
+                         f"{costs[-1] * 1e6:.3f} us per id")
+        growth = costs[-1] / costs[0]
+        if growth > max_growth:
+            logging.error(f"IdIndex {name}: cost per id grew {growth:.1f}x from {sizes[0]} to {sizes[-1]} ids")
+            passed = False
+        else:
+            logging.info(f"IdIndex {name}: cost per id grew {growth:.1f}x from {sizes[0]} to {sizes[-1]} ids")
+    return passed
+
+
+def parse_option(text: str):
+    key, _, value = text.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the loader on synthetic data in a throwaway PostgreSQL.")
+    parser.add_argument('--mapping', nargs='+', default=['account.move'], help="mapping files (XML names) to migrate")
+    parser.add_argument('--rows', nargs='+', type=int, default=[10000], help="rows generated per table, one run each")
+    parser.add_argument('--null-ratio', type=float, default=0.2, help="share of NULL values in generated columns")
+    parser.add_argument('--text-length', type=int, default=24, help="length of generated text values")
+    parser.add_argument('--seed', type=float, default=0.42, help="seed of the generated data, between -1 and 1")
+    parser.add_argument('--loader-option', action='append', default=[], metavar='NAME=VALUE',
+                        help="DataMigration keyword argument, e.g. load_mode=\"upsert\" or workers=4")
+    parser.add_argument('--server-option', action='append', default=[], metavar='NAME=VALUE',
+                        help="PostgreSQL server setting of the benchmark cluster, e.g. shared_buffers=1GB")
+    parser.add_argument('--results-dir', default='benchmark_results', help="directory of the results per commit")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary cluster directory")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'COMMIT'),
+                        help="only compare the stored results of two commits")
+    parser.add_argument('--id-index-scaling', nargs='*', type=int, metavar='IDS',
+                        help="only check that adding ids to an IdIndex scales with its size "
+                             "(default sizes 250000 to 2000000)")
+    args = parser.parse_args()
+
+    current_directory = os.path.dirname(os.path.abspath(__file__))
+    benchmark = Benchmark(os.path.join(current_directory, "mappings"), args.results_dir)
+    if args.id_index_scaling is not None:
+        sys.exit(0 if check_id_index_scaling(sorted(args.id_index_scaling or [250000, 500000, 1000000, 2000000]))
+                 else 1)
+    elif args.compare:
+        benchmark.compare(*args.compare)
+    else:
+        benchmark.run(args.mapping, args.rows, SyntheticSchema(args.null_ratio, args.text_length, args.seed),
+                      dict(parse_option(option) for option in args.loader_option), args.server_option, args.keep)
@@ -1,15 +1,37 @@
 import os
 import json
+import argparse
 import xml.etree.ElementTree as ET
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_batch, execute_values
 import logging
 from typing import Dict, List, Tuple, Optional
-import re
 from datetime import datetime
-import traceback
 import importlib
 import copy
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from itertools import islice
+from helper.CopyBuffer import CopyBuffer
+from helper.BinaryCopyBuffer import BinaryCopyBuffer
+from helper.IdIndex import IdIndex
+from helper.LoadContext import LoadContext
+from helper.RowPlan import RowPlan
+from helper.Checkpoint import CheckpointJournal
+from helper.MappingCache import MappingCache
+from helper.SchemaCatalog import SchemaCatalog
+from helper.Pipeline import Pipeline
+from helper.FastLoad import FastLoad
+from helper.Metrics import MappingMetrics, RunReport
+from helper.Profiler import MappingProfiler
+from helper.Quarantine import Quarantine, FailureLog
+from helper.Parity import ParityCheck
+from helper.SqlTransform import SqlTransform
+from helper.CopyPipe import CopyPipe
+from helper.StagingTable import StagingTable
+from helper.ChangeTracker import ChangeTracker
+from helper.Watermark import WatermarkJournal
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -49,10 +71,93 @@ class DataTypeHandler:
 
 class DataMigration:
 
-    def __init__(self, connection_file: str, models_xml_directory: str, mapping_directory: str):
+    LOAD_MODES = ('copy', 'insert', 'upsert', 'merge')
+    MAPPING_CACHE_FILE = '.mapping_cache.json'
+
+    def __init__(self, connection_file: str, models_xml_directory: str, mapping_directory: str,
+                 stream_rows: bool = True, itersize: int = 2000, batch_size: int = 2000,
+                 load_mode: str = 'copy', upsert_page_size: int = 1000,
+                 preload_ids: bool = True, id_chunk_size: int = 100000,
+                 commit_rows: int = 10000, commit_seconds: float = 30.0, workers: int = 1,
+                 partitions: int = 1, checkpoint: bool = True, resume: bool = False, pipeline: bool = False,
+                 transform_workers: int = 2, queue_size: int = 8, fast_load: Optional[str] = None,
+                 index_workers: int = 4, report_path: Optional[str] = None, prometheus_path: Optional[str] = None,
+                 function_timings: bool = False, profile: Optional[str] = None, profile_directory: str = 'profiles',
+                 profile_top: int = 20, quarantine_file: Optional[str] = None, replay_quarantine: bool = False,
+                 error_log_interval: float = 30.0, pass_through: bool = True, binary_copy: bool = False,
+                 track_changes: bool = False, delta: bool = False, delta_overlap: float = 0.0):
         self.connection_file = connection_file
         self.models_xml_directory = models_xml_directory
         self.mapping_directory = mapping_directory
+        # Read source rows through a server-side cursor instead of fetchall()
+        self.stream_rows = stream_rows
+        # Number of rows the server-side cursor transfers per network round trip
+        self.itersize = itersize
+        # Number of rows handed to process_rows at once
+        self.batch_size = batch_size
+        # How records are written: 'copy' (bulk COPY FROM STDIN for new records),
+        # 'insert' (one INSERT per row), 'upsert' (multi-row INSERT ... ON CONFLICT) or 'merge'
+        # (COPY into an UNLOGGED staging table merged into the target in one transaction, see StagingTable)
+        if load_mode not in self.LOAD_MODES:
+            raise ValueError(f"Unknown load mode: {load_mode}")
+        self.load_mode = load_mode
+        # Number of rows sent per INSERT ... ON CONFLICT statement in upsert mode
+        self.upsert_page_size = upsert_page_size
+        # Load the ids of the target table once instead of asking the new DB about every row
+        self.preload_ids = preload_ids
+        self.id_chunk_size = id_chunk_size
+        # Commit policy: a transaction is committed after this many rows or seconds
+        self.commit_rows = commit_rows
+        self.commit_seconds = commit_seconds
+        # Number of models migrated at the same time, each by its own process and connections
+        self.workers = workers
+        # Number of id ranges a single table is split into, each processed by its own process
+        self.partitions = 1 if replay_quarantine else partitions
+        # Record the progress of every mapping in the new database, and continue from it when resuming.
+        # A quarantine replay only reads the quarantined ids, it neither records nor uses checkpoints
+        self.checkpoint = (checkpoint or resume) and not replay_quarantine
+        self.resume = resume and not replay_quarantine
+        self.checkpoint_journal = CheckpointJournal()
+        # Read, transform and write each mapping at the same time, in a reader thread,
+        # transform_workers processes and the writing thread, with at most queue_size batches in flight
+        self.pipeline = pipeline
+        self.transform_workers = transform_workers
+        self.queue_size = queue_size
+        # Fast load: skip triggers and foreign key checks ('replica' or 'disable', see FastLoad) and
+        # drop secondary indexes while loading, then rebuild them with index_workers connections
+        self.fast_load = FastLoad(fast_load, index_workers) if fast_load else None
+        # Run report: JSON written at the end of the run, Prometheus textfile refreshed after every model
+        self.report_path = report_path
+        self.prometheus_path = prometheus_path
+        # Count the calls and time of every DataTypeHandler converter and processing function
+        self.function_timings = function_timings
+        self.run_report = RunReport()
+        # Profile every mapping ('cprofile' or 'sampling'), one .prof file each and a summary in the run report
+        self.profiler = MappingProfiler(profile, profile_directory, profile_top) if profile else None
+        # Rows that fail are written to the quarantine table, or to quarantine_file (JSONL) when given,
+        # and logged once per error class, then summarized every error_log_interval seconds
+        self.quarantine = Quarantine(quarantine_file)
+        self.error_log_interval = error_log_interval
+        # Migrate only the quarantined rows, {mapping key: ids} read when the migration starts
+        self.replay_quarantine = replay_quarantine
+        self.replay_ids = None
+        # Write new records with binary COPY for every mapping, not only those with <binary_copy>
+        self.binary_copy = binary_copy
+        # Keep a content hash of every written row and skip rows whose hash did not change (see ChangeTracker)
+        self.track_changes = track_changes
+        # Delta migration: only rows whose write_date is past the mark of the last successful run,
+        # read again from delta_overlap seconds before it (see WatermarkJournal)
+        self.delta = delta
+        self.delta_overlap = delta_overlap
+        self.watermark_journal = WatermarkJournal()
+        # Copy mappings without transformation straight from COPY TO to COPY FROM when the target is empty.
+        # Not with change tracking, the copied rows would have no hash
+        self.pass_through = pass_through and not track_changes
+        # Compiled mapping files, recompiled only when their content changes
+        self.mapping_cache = MappingCache(os.path.join(mapping_directory, self.MAPPING_CACHE_FILE))
+        # Columns of the old and new databases, read once before the mappings are processed
+        self.old_schema = None
+        self.new_schema = None
         self.connection_data = self.load_connection_data()
         self.data_type_handler = DataTypeHandler()
 
@@ -73,7 +178,9 @@ class DataMigration:
         if not os.path.exists(file_path):
             logging.warning("XML file not found for model: %s", model_xml_name)
             return None
-        return self.read_mapping_file(file_path)
+        mappings = self.mapping_cache.get(file_path, self.read_mapping_file)
+        # Copies, so the cached mappings are left untouched; the key identifies the mapping in the checkpoint journal
+        return [dict(mapping, mapping_key=f"{model_xml_name}:{index}") for index, mapping in enumerate(mappings)]
 
     # Parses a mapping XML file to extract model mappings.
     def read_mapping_file(self, file_path: str) -> List[Dict]:
@@ -81,33 +188,40 @@ class DataMigration:
             tree = ET.parse(file_path)
             root = tree.getroot()
             mappings = []
-            global start_id
             for mapping in root.findall('mapping'):
-                old_model = mapping.find('old_model').text
-                new_model = mapping.find('new_model').text
+                old_model = mapping.findtext('old_model')
+                new_model = mapping.findtext('new_model')
+                start_id = None
                 start_id_field = mapping.find('start_id')
                 if start_id_field is not None:
                     start_id = int(start_id_field.text)
                 field_mappings = []
                 functions = {}
-                for field in mapping.find('fields'):
+                fields_element = mapping.find('fields')
+                for field in (fields_element if fields_element is not None else []):
                     field_mapping = {}
                     old_field_element = field.find('old_field')
                     new_field_element = field.find('new_field')
                     skip = field.find('skip')
                     function = field.find('function')  # Extract function node
                     field_function = function.text if function is not None else None
-                    if field_function:
-                        functions[new_field] = field_function
 
                     if old_field_element is None or new_field_element is None or skip is not None:
                         continue
 
                     old_field = old_field_element.text
                     new_field = new_field_element.text
+                    if not old_field or not new_field:  # Empty <old_field/> or <new_field/>
+                        continue
+                    if field_function:
+                        functions[new_field] = field_function
 
                     field_mapping['field_name_old'] = old_field
                     field_mapping['field_name_new'] = new_field
+                    # Transformations done by the old database in the SELECT, see SqlTransform
+                    expression = SqlTransform.compile(field, old_field)
+                    if expression:
+                        field_mapping['expression'] = expression
 
                     # Check if old_field_type exists before accessing its text attribute
                     old_field_type_element = field.find('old_field_type')
@@ -118,6 +232,13 @@ class DataMigration:
                         if new_field_type_element is not None:
                             field_mapping['field_type_new'] = new_field_type_element.text
 
+                    # Related model of relational fields, used to order the migration of models
+                    relation_element = field.find('new_relation')
+                    if relation_element is None or not relation_element.text:
+                        relation_element = field.find('old_relation')
+                    if relation_element is not None and relation_element.text:
+                        field_mapping['relation'] = relation_element.text
+
                     field_mappings.append(field_mapping)
                 defaults = {}
                 default_elements = mapping.find('defaults')  # Check if defaults are defined
@@ -127,54 +248,214 @@ class DataMigration:
                         default_value = default.find('value').text
                         defaults[field_name] = default_value
 
+                # Opt-in columnar conversion of fetched batches
+                columnar_element = mapping.find('columnar')
+                columnar = columnar_element is not None and (columnar_element.text or '').strip().lower() in ('1', 'true')
+                # Opt-in binary COPY of new records
+                binary_copy_element = mapping.find('binary_copy')
+                binary_copy = (binary_copy_element is not None
+                               and (binary_copy_element.text or '').strip().lower() in ('1', 'true'))
+
                 mapping = {
                     'old_model': old_model,
                     'new_model': new_model,
                     'field_mappings': field_mappings,
                     'defaults': defaults,
-                    'functions': functions  # Include functions in the mapping,
+                    'functions': functions,  # Include functions in the mapping,
+                    'columnar': columnar,
+                    'binary_copy': binary_copy,
+                    'start_id': start_id,
                 }
-                mappings.append(mapping)
+                if self.validate_mapping(mapping, file_path):
+                    mappings.append(mapping)
             return mappings
         except ET.ParseError as e:
             logging.error("Failed to parse mapping file: %s", e)
             return []
+        except ValueError as e:
+            logging.error("Invalid transformation in mapping file %s: %s", file_path, e)
+            return []
+
+    def validate_mapping(self, mapping: Dict, file_path: str) -> bool:
+        """
+        Checks a parsed mapping before it is compiled into the cache. Mappings that
+        can not be migrated are rejected, other problems are only reported.
+        Args:
+            mapping: Parsed mapping.
+            file_path: Path of the mapping file, for the messages.
+        Returns:
+            True if the mapping can be migrated.
+        """
+        if not mapping['old_model'] or not mapping['new_model']:
+            logging.error(f"Mapping without old_model or new_model in {file_path}, ignored")
+            return False
+        if not mapping['field_mappings']:
+            logging.warning(f"Mapping of {mapping['old_model']} in {file_path} has no fields, ignored")
+            return False
+        new_fields = [field['field_name_new'] for field in mapping['field_mappings']]
+        duplicates = sorted({field for field in new_fields if new_fields.count(field) > 1})
+        if duplicates:
+            logging.warning(f"Fields mapped more than once to {mapping['new_model']} in {file_path}: {duplicates}")
+        if 'id' not in new_fields:
+            logging.warning(f"Mapping of {mapping['new_model']} in {file_path} has no id field")
+        return True
+
+    def compile_mappings(self) -> List[str]:
+        """
+        Compiles models.xml and every mapping file it lists into the mapping cache
+        and saves it. Unchanged files are taken from the cache as they are.
+        Returns:
+            XML names listed in models.xml.
+        """
+        model_xml_names = self.get_xml_names(os.path.join(self.models_xml_directory, 'models.xml'))
+        for xml_name in model_xml_names:
+            self.get_model_mappings(xml_name)
+        self.mapping_cache.save()
+        return model_xml_names
 
     # Main method to handle the data migration process.
     def migrate(self):
 
         old_db = self.connect_to_db(self.connection_data['old_db'])
-        new_db = self.connect_to_db(self.connection_data['new_db'])
+        new_db = self.connect_to_new_db()
 
-        model_xml_names = self.get_xml_names(os.path.join(self.models_xml_directory, 'models.xml'))
-        for xml_name in model_xml_names:
-            mappings = self.get_model_mappings(xml_name)
-            if mappings:
-                self.migrate_data(old_db, new_db, xml_name, mappings)
+        # Compiled and checked before the workers start, they inherit the loaded cache and schemas
+        model_xml_names = self.compile_mappings()
+        self.load_schemas(old_db, new_db)
+        self.check_schemas(model_xml_names)
+        self.quarantine.ensure_table(new_db)
+        if self.replay_quarantine:
+            self.replay_ids = self.quarantine.start_replay(new_db)
+            logging.info(f"Replaying {sum(len(ids) for ids in self.replay_ids.values())} quarantined rows "
+                         f"of {len(self.replay_ids)} mappings")
+        if self.fast_load is not None:
+            # Leftovers of a crashed fast load run are restored before anything else
+            self.restore_fast_load(new_db)
+        if self.workers > 1:
+            old_db.close()
+            new_db.close()
+            self.migrate_parallel(model_xml_names)
+        else:
+            for xml_name in model_xml_names:
+                mappings = self.get_model_mappings(xml_name)
+                if mappings:
+                    self.add_to_report(self.migrate_data(old_db, new_db, xml_name, mappings))
 
-        old_db.close()
-        new_db.close()
+            old_db.close()
+            new_db.close()
+        if self.replay_quarantine:
+            self.quarantine.finish_replay()
+        self.write_report()
 
-    def add_skip_to_mapping(self, xml_name):
-        file_path = os.path.join(self.mapping_directory, f"{xml_name}.xml")
+    def add_to_report(self, mapping_metrics: List[MappingMetrics]):
+        """
+        Adds the metrics of a finished model to the run report and refreshes the Prometheus textfile.
+        """
+        self.run_report.add(mapping_metrics)
+        if self.prometheus_path:
+            self.run_report.write_prometheus(self.prometheus_path)
+
+    def write_report(self):
+        """
+        Writes the JSON run report, when a path was given.
+        """
+        if self.report_path:
+            self.run_report.write(self.report_path)
+            logging.info(f"Run report written to {self.report_path}")
+
+    def build_dependency_graph(self, model_xml_names: List[str]) -> Dict[int, set]:
+        """
+        Builds the dependencies between the entries of models.xml. An entry depends on
+        every other entry writing a table it references through a many2one field, and
+        on the earlier entries writing the same table. Entries whose mappings declare no
+        relation at all depend on every earlier entry, keeping the models.xml order.
+        Args:
+            model_xml_names: XML names in models.xml order.
+        Returns:
+            Dictionary of entry position to the set of positions it depends on.
+        """
+        written_tables = []
+        referenced_tables = []
+        without_relations = set()
+        for index, xml_name in enumerate(model_xml_names):
+            mappings = self.get_model_mappings(xml_name) or []
+            written_tables.append({self.model_to_table(mapping['new_model']) for mapping in mappings})
+            referenced_tables.append({
+                self.model_to_table(field['relation'])
+                for mapping in mappings for field in mapping['field_mappings']
+                if field.get('relation') and field.get('field_type_new', 'many2one') == 'many2one'
+            })
+            if not any(field.get('relation') for mapping in mappings for field in mapping['field_mappings']):
+                without_relations.add(index)
+        if without_relations:
+            logging.warning(f"No relation declared in the mappings of "
+                            f"{', '.join(model_xml_names[index] for index in sorted(without_relations))}, "
+                            f"they are migrated after every earlier model of models.xml")
+        dependencies = {}
+        for index in range(len(model_xml_names)):
+            if index in without_relations:
+                dependencies[index] = set(range(index))
+                continue
+            dependencies[index] = set()
+            for other in range(len(model_xml_names)):
+                if other == index:
+                    continue
+                if referenced_tables[index] & written_tables[other]:
+                    dependencies[index].add(other)
+                elif other < index and written_tables[index] & written_tables[other]:
+                    dependencies[index].add(other)
+        return dependencies
+
+    def migrate_parallel(self, model_xml_names: List[str]):
+        """
+        Migrates the models of models.xml in a pool of worker processes. A model is
+        started as soon as all models it depends on are finished, so independent
+        models run at the same time. Dependency cycles are broken in models.xml order.
+        Args:
+            model_xml_names: XML names in models.xml order.
+        """
+        remaining = self.build_dependency_graph(model_xml_names)
+        finished = set()
+        running = {}
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            while remaining or running:
+                ready = [index for index in sorted(remaining) if remaining[index] <= finished]
+                if not ready and not running:
+                    index = min(remaining)
+                    logging.warning(f"Dependency cycle on {model_xml_names[index]}, "
+                                    f"starting it before {[model_xml_names[i] for i in remaining[index] - finished]}")
+                    ready = [index]
+                for index in ready:
+                    del remaining[index]
+                    running[executor.submit(self.migrate_model, model_xml_names[index])] = index
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = running.pop(future)
+                    finished.add(index)
+                    try:
+                        self.add_to_report(future.result())
+                    except Exception as e:
+                        logging.error(f"Migration of {model_xml_names[index]} failed: {e}")
+
+    def migrate_model(self, xml_name: str) -> List[MappingMetrics]:
+        """
+        Migrates the mappings of one XML file on its own pair of connections.
+        Runs inside a worker process of migrate_parallel.
+        Args:
+            xml_name: Name of the XML file.
+        Returns:
+            Metrics of the migrated mappings.
+        """
+        mappings = self.get_model_mappings(xml_name)
+        if not mappings:
+            return []
+        old_db = self.connect_to_db(self.connection_data['old_db'])
+        new_db = self.connect_to_new_db()
         try:
-            tree = ET.parse(file_path)
-            root = tree.getroot()
-            for mapping in root.findall('mapping'):
-                fields = mapping.find('fields')
-                for field in fields.findall('field'):
-                    # old_field = field.find('old_field')
-                    new_field = field.find('new_field')
-                    # if old_field is None or new_field is None:
-                    # if old_field is None:
-                    if new_field is None:
-                        skip_element = ET.Element('skip')
-
-                        field.append(skip_element)
-            tree.write(file_path)
-            print(f"Updated XML file: {file_path}")
-        except Exception as e:
-            print(f"Error updating XML file: {e}")
+            return self.migrate_data(old_db, new_db, xml_name, mappings)
+        finally:
+            old_db.close()
+            new_db.close()
 
     # Establishes a database connection with given credentials.
     def connect_to_db(self, credentials: Dict[str, str]):
@@ -191,9 +472,40 @@ class DataMigration:
             logging.error("Database connection failed: %s", e)
             raise
 
+    def connect_to_new_db(self):
+        """
+        Connects to the new database, as a loading session of the fast load mode when enabled.
+        """
+        conn = self.connect_to_db(self.connection_data['new_db'])
+        if self.fast_load is not None:
+            self.fast_load.prepare_connection(conn)
+        return conn
+
+    def restore_fast_load(self, new_db_conn, tables=None) -> Dict[str, int]:
+        """
+        Restores the triggers and indexes suspended by the fast load mode.
+        Args:
+            new_db_conn: Connection to the new database.
+            tables: Tables to restore, all tables recorded in the fast load side table when None.
+        Returns:
+            Dictionary of foreign key name to the number of rows violating it.
+        """
+        fast_load = self.fast_load or FastLoad()
+        fast_load.ensure_table(new_db_conn)
+        if tables is None:
+            tables = fast_load.pending_tables(new_db_conn)
+        return fast_load.restore(new_db_conn, tables, lambda: self.connect_to_db(self.connection_data['new_db']))
+
     # Extracts XML names from the models XML file.
     def get_xml_names(self, models_xml_path: str) -> List[str]:
 
+        try:
+            return self.mapping_cache.get(models_xml_path, self.read_models_file)
+        except OSError as e:
+            logging.error("Failed to read models.xml: %s", e)
+            return []
+
+    def read_models_file(self, models_xml_path: str) -> List[str]:
         try:
             tree = ET.parse(models_xml_path)
             root = tree.getroot()
@@ -206,26 +518,124 @@ class DataMigration:
     def model_to_table(self, text):
         return text.replace(".", "_")
 
-    # Performs data migration based on provided mappings.
-    def get_old_fields_list(self, field_mappings, skip_columns):
+    def load_schemas(self, old_db_conn, new_db_conn):
+        """
+        Reads the columns of the old and new databases, one information_schema query each.
+        """
+        self.old_schema = SchemaCatalog.load(old_db_conn)
+        self.new_schema = SchemaCatalog.load(new_db_conn)
+
+    def reconcile_mapping(self, mapping_data) -> Tuple[Optional[List[Dict]], Dict, List[str]]:
         """
-        Gets a list of old fields to be selected from the old database.
+        Checks a mapping against the old and new schemas. Fields whose old or new
+        column does not exist are left out, as are defaults of missing new columns.
         Args:
-            field_mappings: List of field mappings.
-            skip_columns: List of columns to be skipped.
+            mapping_data: Mapping data containing information about models, field mappings, etc.
         Returns:
-            List of old fields.
+            Tuple of the field mappings and defaults that can be migrated, and the list
+            of problems found. The field mappings are None when a table is missing.
         """
-        old_fields_list = []
-        for field_mapping in field_mappings:
-            old_field_name = field_mapping['field_name_old']
-            if old_field_name not in skip_columns:
-                old_fields_list.append(old_field_name)
-            else:
-                logging.info(f"Skipping column {old_field_name}")
-        return old_fields_list
+        old_table = self.model_to_table(mapping_data['old_model'])
+        new_table = self.model_to_table(mapping_data['new_model'])
+        problems = []
+        if not self.old_schema.has_table(old_table):
+            problems.append(f"old table {old_table} does not exist")
+        if not self.new_schema.has_table(new_table):
+            problems.append(f"new table {new_table} does not exist")
+        if problems:
+            return None, {}, problems
+        field_mappings = mapping_data['field_mappings']
+        missing_old = self.old_schema.missing_columns(old_table, [field['field_name_old'] for field in field_mappings])
+        missing_new = self.new_schema.missing_columns(new_table, [field['field_name_new'] for field in field_mappings])
+        missing_defaults = self.new_schema.missing_columns(new_table, mapping_data['defaults'])
+        if missing_old:
+            problems.append(f"columns missing in {old_table}: {', '.join(missing_old)}")
+        if missing_new:
+            problems.append(f"columns missing in {new_table}: {', '.join(missing_new)}")
+        if missing_defaults:
+            problems.append(f"default columns missing in {new_table}: {', '.join(missing_defaults)}")
+        field_mappings = [field for field in field_mappings
+                          if field['field_name_old'] not in missing_old and field['field_name_new'] not in missing_new]
+        defaults = {field: value for field, value in mapping_data['defaults'].items() if field not in missing_defaults}
+        return field_mappings, defaults, problems
+
+    def check_schemas(self, model_xml_names: List[str]) -> int:
+        """
+        Reconciles every mapping of models.xml with the schemas and reports all
+        missing tables and columns in one pass, before any table is read.
+        Args:
+            model_xml_names: XML names in models.xml order.
+        Returns:
+            Number of mappings with problems.
+        """
+        mappings_with_problems = 0
+        for xml_name in model_xml_names:
+            for mapping_data in self.get_model_mappings(xml_name) or []:
+                _, _, problems = self.reconcile_mapping(mapping_data)
+                if problems:
+                    mappings_with_problems += 1
+                    logging.warning(f"{mapping_data['mapping_key']} ({mapping_data['old_model']} -> "
+                                    f"{mapping_data['new_model']}): {'; '.join(problems)}")
+        logging.info(f"Schema check done, {mappings_with_problems} mappings with missing tables or columns")
+        return mappings_with_problems
 
-    def process_mapping_data(self, mapping_data, old_cursor, new_cursor, xml_name, old_db_conn, new_db_conn):
+    def verify_parity(self, chunk_size: int = 10000, sample: int = 10, report_path: Optional[str] = None) -> int:
+        """
+        Compares every mapping of models.xml between the old and new databases with
+        chunked row hashes computed by the databases (see ParityCheck).
+        Args:
+            chunk_size: Number of consecutive ids hashed together.
+            sample: Differing ids listed, and rows compared column by column, per mapping.
+            report_path: Optional path of the JSON parity report.
+        Returns:
+            Number of mappings that differ or could not be verified.
+        """
+        old_db = self.connect_to_db(self.connection_data['old_db'])
+        new_db = self.connect_to_db(self.connection_data['new_db'])
+        model_xml_names = self.compile_mappings()
+        self.load_schemas(old_db, new_db)
+        parity_check = ParityCheck(self.old_schema, self.new_schema, chunk_size, sample)
+        results = []
+        for xml_name in model_xml_names:
+            for mapping_data in self.get_model_mappings(xml_name) or []:
+                field_mappings, defaults, problems = self.reconcile_mapping(mapping_data)
+                if not field_mappings:
+                    logging.error(f"Skipping {mapping_data['mapping_key']}: {'; '.join(problems) or 'no columns'}")
+                    continue
+                result = parity_check.verify_safely(old_db, new_db, mapping_data['mapping_key'],
+                                                    self.model_to_table(mapping_data['old_model']),
+                                                    self.model_to_table(mapping_data['new_model']),
+                                                    field_mappings, mapping_data.get('functions', {}),
+                                                    mapping_data.get('start_id'), defaults)
+                parity_check.log_result(result)
+                results.append(result)
+        old_db.close()
+        new_db.close()
+        if report_path:
+            parity_check.write(results, report_path)
+            logging.info(f"Parity report written to {report_path}")
+        return sum(1 for result in results if result['status'] != 'ok')
+
+    def run_mapping(self, mapping_data, old_cursor, new_cursor, xml_name, old_db_conn, new_db_conn, id_range=None):
+        """
+        Processes a mapping with process_mapping_data, under the profiler when profiling is enabled.
+        The profile summary is added to the metrics of the mapping.
+        """
+        if self.profiler is None:
+            return self.process_mapping_data(mapping_data, old_cursor, new_cursor, xml_name, old_db_conn, new_db_conn,
+                                             id_range)
+        name = mapping_data.get('mapping_key', xml_name)
+        if id_range is not None:
+            name += f"[{id_range[0]}:{id_range[1]}]"
+        metrics, profile = self.profiler.run(name, self.process_mapping_data, mapping_data, old_cursor, new_cursor,
+                                             xml_name, old_db_conn, new_db_conn, id_range)
+        logging.info(f"Profile of {name} written to {profile['file']}")
+        if metrics is not None:
+            metrics.extra['profile'] = profile
+        return metrics
+
+    def process_mapping_data(self, mapping_data, old_cursor, new_cursor, xml_name, old_db_conn, new_db_conn,
+                             id_range=None):
         """
         Processes a single mapping data.
         Args:
@@ -235,14 +645,51 @@ class DataMigration:
             xml_name: Name of the XML file.
             old_db_conn: Connection to the old database.
             new_db_conn: Connection to the new database.
+            id_range: Optional (lower, upper) id bounds, only rows with lower <= id < upper are processed.
+        Returns:
+            MappingMetrics of the mapping, None when it was skipped.
         """
-        self.add_skip_to_mapping(xml_name)
+        # Failed rows are quarantined under the key of the whole mapping, whatever partition they come from
+        quarantine_key = mapping_data.get('mapping_key', xml_name)
+        mapping_key = quarantine_key
+        if id_range is not None:
+            mapping_key += f"[{id_range[0]}:{id_range[1]}]"
+        replay_ids = None
+        if self.replay_ids is not None:
+            replay_ids = self.replay_ids.get(quarantine_key)
+            if not replay_ids:
+                logging.info(f"Skipping {mapping_key}, no quarantined rows")
+                return
+        checkpoint = None
+        if self.checkpoint:
+            checkpoint = self.checkpoint_journal.load(new_cursor, mapping_key) if self.resume else None
+            new_db_conn.commit()
+            if checkpoint and checkpoint['status'] == 'done':
+                logging.info(f"Skipping {mapping_key}, already migrated according to the checkpoint")
+                return
+            if checkpoint and checkpoint['status'] == 'merge_failed':
+                logging.error(f"Skipping {mapping_key}, the merge of its staging table failed in the "
+                              f"interrupted run; run it again without --resume")
+                return
+        # Columns missing from either schema were reported by check_schemas, they are left out here
+        field_mappings, defaults, problems = self.reconcile_mapping(mapping_data)
+        if field_mappings is None:
+            logging.error(f"Skipping {mapping_key}: {'; '.join(problems)}")
+            return
+        if not field_mappings:
+            logging.error(f"Skipping {mapping_key}: none of its columns exist in both databases")
+            return
+        delta_mark = next_mark = None
+        if self.delta and replay_ids is None:
+            delta_mark, next_mark = self.get_delta_marks(mapping_data, field_mappings, old_db_conn, new_cursor,
+                                                         quarantine_key, id_range)
+        if id_range is None and self.partitions > 1:
+            return self.process_partitions(mapping_data, old_cursor, new_cursor, xml_name, old_db_conn, new_db_conn,
+                                           mapping_key, checkpoint, next_mark)
         module = None
-        unresolved_skips = True
         old_table = self.model_to_table(mapping_data['old_model'])
         new_table = self.model_to_table(mapping_data['new_model'])
-        field_mappings = mapping_data['field_mappings']
-        defaults = mapping_data['defaults']
+        metrics = MappingMetrics(mapping_key, old_table, new_table)
         functions = mapping_data.get('functions', {})
         if functions:
             module_name = f"processing.{new_table.lower()}"
@@ -250,62 +697,807 @@ class DataMigration:
                 module = importlib.import_module(module_name)
             except ImportError:
                 logging.info(f"Error: process file {module_name} not found or could not be imported.")
-        skip_columns = []
-        while unresolved_skips:
-            unresolved_skips = False
-            try:
-                old_fields_list = self.get_old_fields_list(field_mappings, skip_columns)
-                old_fields = ', '.join(old_fields_list)
-                old_db_conn.rollback()  # Rollback previous transaction
-                old_cursor.execute(f'SELECT {old_fields} FROM {old_table}')
-                rows = old_cursor.fetchall()
-            except psycopg2.errors.UndefinedColumn as e:
-                column_name = re.findall(r'column "(.*?)" does not exist', str(e))
-                logging.info(f"Error finding column name: {column_name}")
-                if column_name:
-                    skip_columns.append(column_name[0])
-                    unresolved_skips = True
-                else:
-                    logging.info(f"Error parsing column name: {e}")
-        self.process_rows(rows, new_cursor, new_table, field_mappings, defaults, functions, new_db_conn)
-
-    def process_rows(self, rows, new_cursor, new_table, field_mappings, defaults, functions, new_db_conn):
-        for row in rows:
-            update_row = row
+        id_field = self.get_old_id_field(field_mappings)
+        # Rows are read in id order when checkpointing, so the last committed id marks the progress
+        order_by = id_field if self.checkpoint else None
+        after_id = checkpoint['last_id'] if checkpoint else None
+        conditions, params = self.get_source_conditions(field_mappings, id_range, mapping_data.get('start_id'),
+                                                        replay_ids, delta_mark)
+        old_fields_list = [field.get('expression', field['field_name_old']) for field in field_mappings]
+        plan = RowPlan(new_table, field_mappings, defaults, functions, DataTypeHandler, module,
+                       mapping_data.get('columnar', False), self.function_timings)
+        if self.load_mode in ('copy', 'merge') and (self.binary_copy or mapping_data.get('binary_copy')):
+            self.use_binary_copy(plan)
+        old_db_conn.rollback()  # Rollback previous transaction
+        if (self.pass_through and not functions and not plan.converters and replay_ids is None
+                and after_id is None):
+            rows_copied = self.copy_pass_through(old_db_conn, new_cursor, plan, old_table, old_fields_list,
+                                                 conditions, params, id_range, mapping_data.get('start_id'),
+                                                 mapping_key if self.checkpoint else None)
+            if rows_copied is not None:
+                logging.info(f"Copied {rows_copied} rows to {new_table} without transformation")
+                if next_mark is not None:
+                    self.watermark_journal.record(new_cursor, quarantine_key, next_mark)
+                    new_db_conn.commit()
+                metrics.rows_read = metrics.rows_written = rows_copied
+                metrics.extra['pass_through'] = True
+                metrics.finish()
+                return metrics
+        source_cursor = None
+        if not self.resume:
+            # Pages are read later when resuming
+            source_cursor = self.open_source_cursor(old_db_conn, old_cursor, old_table)
+            source_cursor.execute(self.build_select_query(old_fields_list, old_table, conditions, order_by), params)
+        id_index = None
+        if self.preload_ids and self.load_mode not in ('upsert', 'merge'):
+            id_index = IdIndex.load(new_db_conn, new_table, self.id_chunk_size, *(id_range or ()))
+            logging.info(f"Loaded {len(id_index)} existing ids of {new_table}")
+        context = LoadContext(plan, id_index, self.commit_rows, self.commit_seconds)
+        context.metrics = metrics
+        context.quarantine = self.quarantine
+        context.quarantine_key = quarantine_key
+        context.old_table = old_table
+        context.failure_log = FailureLog(new_table, self.error_log_interval)
+        if replay_ids is not None:
+            context.replayed_ids = []
+        if self.load_mode == 'merge':
+            context.staging_table = StagingTable(plan, mapping_key)
+            # The staged rows of an interrupted run are kept when resuming it
+            context.staging_table.create(new_cursor, keep=checkpoint is not None)
+            new_db_conn.commit()
+        if self.track_changes:
+            context.change_tracker = ChangeTracker(quarantine_key, plan)
+            if context.staging_table is not None:
+                context.change_tracker.stage(new_cursor, context.staging_table.name, keep=checkpoint is not None)
+                new_db_conn.commit()
+        if self.checkpoint:
+            context.mapping_key = mapping_key
+            context.checkpoint_journal = self.checkpoint_journal
+            context.last_seen_id = after_id
+            if checkpoint:
+                context.rows_committed = checkpoint['rows_committed']
+                context.rows_failed = checkpoint['rows_failed']
+                logging.info(f"Resuming {mapping_key} after id {after_id}")
+            self.checkpoint_journal.record(new_cursor, mapping_key, after_id, context.rows_committed,
+                                           context.rows_failed, 'running')
+            new_db_conn.commit()
+        if self.resume:
+            batches = self.fetch_pages(old_db_conn, old_fields_list, old_table, conditions, params, id_field,
+                                       plan.id_position, after_id)
+        else:
+            batches = self.fetch_batches(source_cursor)
+        batches = metrics.timed_batches(batches)
+        rows_committed, rows_failed = context.rows_committed, context.rows_failed
+        try:
+            if self.pipeline:
+                stats = Pipeline(plan, self.transform_workers, self.queue_size).run(
+                    batches, lambda rows, records, failures: self.load_rows(rows, records, failures, new_cursor,
+                                                                           context))
+                logging.info(f"Pipeline of {mapping_key}: {stats.summary()}")
+                metrics.seconds['transform'] += stats.busy['transform']
+                metrics.add_functions(stats.functions)
+                metrics.pipeline = stats.as_dict()
+            else:
+                for rows in batches:
+                    self.process_rows(rows, new_cursor, context)
+            self.commit_batch(new_cursor, context)
+            if context.staging_table is not None and not self.merge_staging_table(new_cursor, context):
+                return metrics
+            if self.checkpoint:
+                # In merge mode, same transaction as the merge
+                self.checkpoint_journal.record(new_cursor, mapping_key, context.last_seen_id, context.rows_committed,
+                                               context.rows_failed, 'done')
+            if next_mark is not None:
+                self.watermark_journal.record(new_cursor, quarantine_key, next_mark)
+            new_db_conn.commit()
+            # Rows the merge left out, appended to the quarantine file once it is committed
+            self.quarantine.write_committed(context.quarantined)
+            context.quarantined = []
+            unchanged = f", {context.rows_unchanged} unchanged" if context.change_tracker is not None else ''
+            logging.info(f"Migrated {context.rows_committed} rows to {new_table}, {context.rows_failed} failed"
+                         f"{unchanged}")
+        finally:
+            if source_cursor is not None and source_cursor is not old_cursor:
+                source_cursor.close()
+            old_db_conn.rollback()  # Release the snapshot held by the server-side cursor
+            metrics.rows_written = context.rows_committed - rows_committed
+            metrics.rows_failed = context.rows_failed - rows_failed
+            if context.change_tracker is not None:
+                metrics.extra['rows_unchanged'] = context.rows_unchanged
+            context.failure_log.summarize()
+            if context.failure_log.totals:
+                metrics.extra['errors'] = dict(context.failure_log.totals)
+            metrics.finish()
+        return metrics
+
+    def use_binary_copy(self, plan):
+        """
+        Makes a plan write its new records with binary COPY, encoded from the column types
+        of the new schema. Tables with a column type that has no encoder keep the text format.
+        Args:
+            plan: RowPlan of the mapping.
+        """
+        column_types = [self.new_schema.column_type(plan.new_table, column) for column in plan.insert_columns]
+        unsupported = BinaryCopyBuffer.unsupported_types(column_types)
+        if unsupported:
+            logging.info(f"Using text COPY for {plan.new_table}, no binary encoder for: "
+                         f"{', '.join(sorted(set(map(str, unsupported))))}")
+            return
+        plan.copy_types = column_types
+
+    def copy_pass_through(self, old_db_conn, new_cursor, plan, old_table, old_fields_list, conditions, params,
+                          id_range=None, start_id=None, mapping_key=None) -> Optional[int]:
+        """
+        Copies a mapping without transformation by streaming `COPY (SELECT ...) TO STDOUT`
+        from the old database into `COPY ... FROM STDIN` on the new one, in one transaction.
+        Only used when the target has no rows in the id range of the mapping, as COPY
+        can not update existing rows nor isolate failing ones.
+        Args:
+            old_db_conn: Connection to the old database.
+            new_cursor: Cursor for the new database.
+            plan: RowPlan of the mapping, it has no converters nor processing functions.
+            old_table: Name of the old table.
+            old_fields_list: Columns, or SQL expressions of transformed columns, in field mapping order.
+            conditions: SQL conditions of the source rows, combined with AND.
+            params: Parameters of the conditions.
+            id_range: Optional (lower, upper) id bounds of the mapping.
+            start_id: Optional <start_id> of the mapping.
+            mapping_key: Key of the mapping in the checkpoint journal, None when not checkpointing.
+        Returns:
+            Number of rows copied, None when the mapping has to go through the regular path.
+        """
+        new_conditions, new_params = self.get_source_conditions([], id_range, start_id)
+        new_cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {plan.new_table}"
+                           + (' WHERE ' + ' AND '.join(new_conditions) if new_conditions else '') + ")", new_params)
+        target_has_rows = new_cursor.fetchone()[0]
+        new_cursor.connection.rollback()
+        if target_has_rows:
+            return None
+        # Same columns as the regular path: mapped fields, then the defaults as constants
+        select_columns = [('NULL' if source is None else SqlTransform.literal(str(source))) if is_default
+                          else old_fields_list[source] for is_default, source in plan.insert_sources]
+        with old_db_conn.cursor() as old_cursor:
+            select_query = old_cursor.mogrify(self.build_select_query(select_columns, old_table, conditions),
+                                              params).decode()
+            started = time.perf_counter()
+            copy_pipe = CopyPipe()
             try:
-                # Convert row tuple to list to make it mutable
-                update_row = list(row)
-                unique_id = update_row[0]  # Assuming the unique ID is at index 0
-
-                # Create a new list starting from index 1
-                data_row_trimmed = [update_row[0]] + update_row[1:]
-                for field in field_mappings:  # Ensure field is a dictionary
-                    old_field_type = field.get('field_type_old')
-                    new_field_type = field.get('field_type_new')
-                    field_index = field_mappings.index(field)
-                    if old_field_type and new_field_type and old_field_type != new_field_type:
-                        field_value = data_row_trimmed[field_index]
-                        if field_value is not None:
-                            data_type = 'adapt_' + old_field_type.lower() + '_to_' + new_field_type.lower()
-                            handler_func = getattr(DataTypeHandler, data_type, None)
-                            if handler_func:
-                                # Update the value in the list
-                                data_row_trimmed[field_index] = handler_func(field_value)
-                            else:
-                                print(f"No handler found for data type: {data_type}")
-
-                # Convert the updated list back to tuple
-                data_row_trimmed = tuple(data_row_trimmed)
+                rows_copied = copy_pipe.run(
+                    old_cursor, f"COPY ({select_query}) TO STDOUT WITH (FORMAT text, ENCODING 'UTF8')",
+                    new_cursor, f"COPY {plan.new_table} ({', '.join(plan.insert_columns)}) FROM STDIN "
+                                f"WITH (FORMAT text, ENCODING 'UTF8')")
+                if mapping_key is not None:
+                    self.checkpoint_journal.record(new_cursor, mapping_key, None, rows_copied, 0, 'done')
+                new_cursor.connection.commit()
+            except (psycopg2.Error, RuntimeError) as e:
+                new_cursor.connection.rollback()
+                logging.info(f"Pass-through copy of {old_table} to {plan.new_table} failed, "
+                             f"migrating it row by row: {e}")
+                return None
+            finally:
+                old_db_conn.rollback()
+        logging.info(f"Passed {copy_pipe.bytes_copied} bytes from {old_table} to {plan.new_table} "
+                     f"in {time.perf_counter() - started:.1f}s")
+        return rows_copied
+
+    def merge_staging_table(self, new_cursor, context) -> bool:
+        """
+        Merges the staging table of a mapping into its target and drops it, without committing.
+        Records the merge refuses are isolated by bisecting their id range under savepoints,
+        quarantined and left out. When the merge fails as a whole the transaction is rolled
+        back, the staging table is kept and the checkpoint records the failure, so a resumed
+        run skips the mapping instead of failing on the same merge again.
+        Args:
+            new_cursor: Cursor for the new database.
+            context: LoadContext of the mapping being processed.
+        Returns:
+            True when the staged rows were merged.
+        """
+        staging_table = context.staging_table
+        started = time.perf_counter()
+        try:
+            merged = self.merge_staged_range(new_cursor, context)
+            staging_table.drop(new_cursor)
+            if context.change_tracker is not None:
+                context.change_tracker.merge_staged(new_cursor)
+            # Same transaction as the merge, the quarantine table only holds rows left out of it
+            context.quarantine.write_pending(new_cursor, context.quarantined)
+        except psycopg2.Error as e:
+            new_cursor.connection.rollback()
+            logging.error(f"Merge of {staging_table.name} into {context.new_table} failed, "
+                          f"the staging table is kept: {e}")
+            context.quarantined = []
+            if context.metrics is not None:
+                context.metrics.extra['merge_error'] = str(e).strip()
+            if context.checkpoint_journal is not None:
+                context.checkpoint_journal.record(new_cursor, context.mapping_key, context.last_seen_id,
+                                                  context.rows_committed, context.rows_failed, 'merge_failed')
+                new_cursor.connection.commit()
+            return False
+        seconds = time.perf_counter() - started
+        logging.info(f"Merged {merged} rows of {staging_table.name} into {context.new_table} in {seconds:.1f}s")
+        if context.metrics is not None:
+            context.metrics.extra['merge_seconds'] = round(seconds, 3)
+        return True
+
+    def merge_staged_range(self, new_cursor, context, lower=None, upper=None) -> int:
+        """
+        Merges the staged rows of an id range under a savepoint. When the range fails it is
+        split in two and each half merged on its own, down to single records, which are
+        quarantined and removed from the staging table.
+        Args:
+            new_cursor: Cursor for the new database.
+            context: LoadContext of the mapping being processed.
+            lower: Inclusive lower bound of the ids, None for the whole staging table.
+            upper: Exclusive upper bound of the ids.
+        Returns:
+            Number of rows merged.
+        """
+        staging_table = context.staging_table
+        new_cursor.execute("SAVEPOINT merge_range")
+        try:
+            merged = staging_table.merge(new_cursor, lower, upper)
+            new_cursor.execute("RELEASE SAVEPOINT merge_range")
+            return merged
+        except psycopg2.Error as e:
+            new_cursor.execute("ROLLBACK TO SAVEPOINT merge_range")
+            new_cursor.execute("RELEASE SAVEPOINT merge_range")
+            if 'id' not in context.plan.insert_columns:
+                raise
+            if lower is None:
+                bounds = staging_table.id_bounds(new_cursor)
+                if bounds is None:
+                    raise
+                lower, upper = bounds[0], bounds[1] + 1
+            if upper - lower <= 1:
+                context.rows_committed -= staging_table.discard(new_cursor, lower)
+                if context.change_tracker is not None:
+                    context.change_tracker.discard_staged(new_cursor, lower)
+                self.quarantine_row(context, lower, 'merge', type(e).__name__, str(e).strip())
+                return 0
+        middle = (lower + upper) // 2
+        return (self.merge_staged_range(new_cursor, context, lower, middle)
+                + self.merge_staged_range(new_cursor, context, middle, upper))
+
+    def build_select_query(self, old_fields_list, old_table, conditions, order_by=None) -> str:
+        """
+        Builds the SELECT reading a mapping from the old table.
+        Args:
+            old_fields_list: Columns, or SQL expressions of transformed columns, to select.
+            old_table: Name of the old table.
+            conditions: SQL conditions combined with AND.
+            order_by: Optional column to order the rows by.
+        Returns:
+            The SQL query.
+        """
+        select_query = f"SELECT {', '.join(old_fields_list)} FROM {old_table}"
+        if conditions:
+            select_query += ' WHERE ' + ' AND '.join(conditions)
+        if order_by:
+            select_query += f' ORDER BY {order_by}'
+        return select_query
+
+    def fetch_pages(self, old_db_conn, old_fields_list, old_table, conditions, params, id_field, id_position,
+                    after_id=None):
+        """
+        Yields the rows of a mapping with keyset pagination
+        (WHERE id > last_id ORDER BY id LIMIT batch_size), one short query per page.
+        Args:
+            old_db_conn: Connection to the old database.
+            old_fields_list: Columns to select.
+            old_table: Name of the old table.
+            conditions: SQL conditions combined with AND.
+            params: Parameters of the conditions.
+            id_field: Name of the id column in the old table.
+            id_position: Position of the id column in the selected rows.
+            after_id: Only rows with a greater id are read, None to start from the first row.
+        """
+        with old_db_conn.cursor() as cursor:
+            while True:
+                page_conditions = list(conditions)
+                page_params = list(params)
+                if after_id is not None:
+                    page_conditions.append(f"{id_field} > %s")
+                    page_params.append(after_id)
+                cursor.execute(self.build_select_query(old_fields_list, old_table, page_conditions, id_field)
+                               + ' LIMIT %s', page_params + [self.batch_size])
+                rows = cursor.fetchall()
+                old_db_conn.rollback()
+                if not rows:
+                    break
+                yield rows
+                after_id = rows[-1][id_position]
+                if len(rows) < self.batch_size:
+                    break
+
+    def get_old_id_field(self, field_mappings) -> str:
+        """
+        Returns the old column mapped to the new `id` column.
+        """
+        for field in field_mappings:
+            if field['field_name_new'] == 'id':
+                return field['field_name_old']
+        return 'id'
+
+    def get_source_conditions(self, field_mappings, id_range=None, start_id=None, record_ids=None,
+                              delta_mark=None) -> Tuple[List[str], List]:
+        """
+        Builds the WHERE conditions restricting the rows selected from the old table.
+        Args:
+            field_mappings: List of field mappings.
+            id_range: Optional (lower, upper) id bounds.
+            start_id: Optional <start_id> of the mapping, rows with a lower id are not migrated.
+            record_ids: Optional list of ids, only these rows are selected.
+            delta_mark: Optional (write_date, id) mark, only rows modified after it are selected.
+        Returns:
+            Tuple of the list of SQL conditions and the list of their parameters.
+        """
+        conditions = []
+        params = []
+        if start_id:
+            conditions.append(f"{self.get_old_id_field(field_mappings)} >= %s")
+            params.append(start_id)
+        if id_range is not None:
+            id_field = self.get_old_id_field(field_mappings)
+            lower, upper = id_range
+            if lower is not None:
+                conditions.append(f"{id_field} >= %s")
+                params.append(lower)
+            if upper is not None:
+                conditions.append(f"{id_field} < %s")
+                params.append(upper)
+        if record_ids is not None:
+            conditions.append(f"{self.get_old_id_field(field_mappings)} = ANY(%s)")
+            params.append(list(record_ids))
+        if delta_mark is not None:
+            delta_conditions, delta_params = self.watermark_journal.conditions(
+                delta_mark, self.get_old_id_field(field_mappings), self.delta_overlap)
+            conditions += delta_conditions
+            params += delta_params
+        return conditions, params
+
+    def get_delta_marks(self, mapping_data, field_mappings, old_db_conn, new_cursor, mapping_key, id_range=None):
+        """
+        Reads the write_date mark of the last successful run of a mapping and, for the
+        whole mapping only, the mark this run will store when it succeeds. Taken before
+        any row is read, so rows modified during the run are read again by the next one.
+        Args:
+            mapping_data: Mapping data containing information about models, field mappings, etc.
+            field_mappings: Field mappings that exist in both schemas.
+            old_db_conn: Connection to the old database.
+            new_cursor: Cursor for the new database.
+            mapping_key: Key of the whole mapping in the watermark journal.
+            id_range: Id bounds of a partition, its mark is stored by the whole mapping.
+        Returns:
+            Tuple of the mark of the last run and the mark of this run, None when there is none.
+        """
+        old_table = self.model_to_table(mapping_data['old_model'])
+        if self.old_schema.column_type(old_table, WatermarkJournal.COLUMN) is None:
+            logging.info(f"{old_table} has no {WatermarkJournal.COLUMN}, {mapping_key} is migrated in full")
+            return None, None
+        delta_mark = self.watermark_journal.load(new_cursor, mapping_key)
+        new_cursor.connection.commit()
+        next_mark = None
+        if id_range is None:
+            next_mark = self.watermark_journal.current(old_db_conn, old_table, self.get_old_id_field(field_mappings))
+        if delta_mark is not None:
+            logging.info(f"Migrating rows of {old_table} modified after {delta_mark[0]} (id {delta_mark[1]})")
+        return delta_mark, next_mark
+
+    def get_partition_ranges(self, old_cursor, old_table, id_field, partitions) -> List[Tuple]:
+        """
+        Splits the ids of a table into ranges holding about the same number of rows,
+        using the histogram bounds of pg_stats when available and min/max otherwise.
+        Args:
+            old_cursor: Cursor for the old database.
+            old_table: Name of the table to split.
+            id_field: Name of the id column.
+            partitions: Number of ranges wanted.
+        Returns:
+            List of (lower, upper) tuples, None meaning unbounded.
+        """
+        old_cursor.execute("SELECT histogram_bounds::text FROM pg_stats "
+                           "WHERE schemaname = 'public' AND tablename = %s AND attname = %s", (old_table, id_field))
+        row = old_cursor.fetchone()
+        bounds = [int(value) for value in row[0].strip('{}').split(',')] if row and row[0] else []
+        if len(bounds) > partitions:
+            split_points = [bounds[len(bounds) * part // partitions] for part in range(1, partitions)]
+        else:
+            old_cursor.execute(f"SELECT MIN({id_field}), MAX({id_field}) FROM {old_table}")
+            min_id, max_id = old_cursor.fetchone()
+            if min_id is None:
+                return [(None, None)]
+            step = (max_id - min_id + 1) / partitions
+            split_points = [min_id + int(step * part) for part in range(1, partitions)]
+        split_points = sorted(set(split_points))
+        return list(zip([None] + split_points, split_points + [None]))
+
+    def process_partitions(self, mapping_data, old_cursor, new_cursor, xml_name, old_db_conn, new_db_conn,
+                           mapping_key, checkpoint=None, watermark=None):
+        """
+        Processes a mapping as id ranges in parallel worker processes, each with
+        its own old/new connections. Returns once every range is finished.
+        Args:
+            mapping_data: Mapping data containing information about models, field mappings, etc.
+            old_cursor: Cursor for the old database.
+            new_cursor: Cursor for the new database.
+            xml_name: Name of the XML file.
+            old_db_conn: Connection to the old database.
+            new_db_conn: Connection to the new database.
+            mapping_key: Key of the mapping in the checkpoint journal.
+            checkpoint: Checkpoint of the mapping when resuming, it holds the ranges of the interrupted run.
+            watermark: Delta mark stored once every range succeeded, None when not in delta mode.
+        Returns:
+            MappingMetrics of the mapping, the sum of its partitions.
+        """
+        old_table = self.model_to_table(mapping_data['old_model'])
+        metrics = MappingMetrics(mapping_key, old_table, self.model_to_table(mapping_data['new_model']))
+        id_field = self.get_old_id_field(mapping_data['field_mappings'])
+        if checkpoint and checkpoint['id_ranges']:
+            id_ranges = checkpoint['id_ranges']
+        else:
+            id_ranges = self.get_partition_ranges(old_cursor, old_table, id_field, self.partitions)
+        old_db_conn.rollback()
+        if self.checkpoint:
+            self.checkpoint_journal.record(new_cursor, mapping_key, None, 0, 0, 'running', id_ranges)
+            new_db_conn.commit()
+        logging.info(f"Processing {old_table} in {len(id_ranges)} partitions: {id_ranges}")
+        failed = False
+        with ProcessPoolExecutor(max_workers=len(id_ranges)) as executor:
+            futures = {executor.submit(self.migrate_partition, mapping_data, xml_name, id_range): id_range
+                       for id_range in id_ranges}
+            for future in as_completed(futures):
+                try:
+                    partition_metrics = future.result()
+                    if partition_metrics is not None:
+                        metrics.merge(partition_metrics)
+                        if 'merge_error' in partition_metrics.extra:
+                            failed = True
+                except Exception as e:
+                    failed = True
+                    logging.error(f"Partition {futures[future]} of {old_table} failed: {e}")
+        if not failed:
+            if self.checkpoint:
+                self.checkpoint_journal.record(new_cursor, mapping_key, None, 0, 0, 'done')
+            if watermark is not None:
+                self.watermark_journal.record(new_cursor, mapping_data.get('mapping_key', xml_name), watermark)
+            new_db_conn.commit()
+        metrics.finish()
+        return metrics
+
+    def migrate_partition(self, mapping_data, xml_name, id_range):
+        """
+        Processes one id range of a mapping on its own pair of connections.
+        Runs inside a worker process of process_partitions.
+        """
+        old_db = self.connect_to_db(self.connection_data['old_db'])
+        new_db = self.connect_to_new_db()
+        old_cursor = old_db.cursor()
+        new_cursor = new_db.cursor()
+        try:
+            return self.run_mapping(mapping_data, old_cursor, new_cursor, xml_name, old_db, new_db, id_range)
+        finally:
+            old_cursor.close()
+            new_cursor.close()
+            old_db.close()
+            new_db.close()
+
+    def open_source_cursor(self, old_db_conn, old_cursor, old_table):
+        """
+        Returns the cursor used to read a table from the old database.
+        In streaming mode this is a named (server-side) cursor, so rows stay on
+        the server until they are fetched in chunks of `itersize`.
+        Args:
+            old_db_conn: Connection to the old database.
+            old_cursor: Regular cursor for the old database.
+            old_table: Name of the table that will be read.
+        Returns:
+            A psycopg2 cursor.
+        """
+        if not self.stream_rows:
+            return old_cursor
+        source_cursor = old_db_conn.cursor(name=f"migrate_{old_table}")
+        source_cursor.itersize = self.itersize
+        return source_cursor
+
+    def fetch_batches(self, cursor):
+        """
+        Yields the rows of an executed cursor in lists of at most `batch_size` rows.
+        Args:
+            cursor: Cursor on which the SELECT has been executed.
+        """
+        rows_iterator = iter(cursor)
+        while True:
+            rows = list(islice(rows_iterator, self.batch_size))
+            if not rows:
+                break
+            yield rows
+
+    def process_rows(self, rows, new_cursor, context):
+        """
+        Transforms a batch of source rows and writes it to the new table inside
+        the open transaction, committing whenever the commit policy is due.
+        Args:
+            rows: Rows selected from the old table.
+            new_cursor: Cursor for the new database.
+            context: LoadContext of the mapping being processed.
+        """
+        started = time.perf_counter()
+        records, failures = context.plan.transform_batch(rows)
+        if context.metrics is not None:
+            context.metrics.seconds['transform'] += time.perf_counter() - started
+            context.metrics.add_functions(context.plan.take_timings())
+        self.load_rows(rows, records, failures, new_cursor, context)
+
+    def load_rows(self, rows, records, failures, new_cursor, context):
+        """
+        Writes a transformed batch to the new table inside the open transaction,
+        committing whenever the commit policy is due.
+        Args:
+            rows: Rows selected from the old table.
+            records: Transformed rows.
+            failures: Rows that could not be transformed, as returned by RowPlan.transform_batch.
+            new_cursor: Cursor for the new database.
+            context: LoadContext of the mapping being processed.
+        """
+        for row, error_class, message, traceback_text in failures:
+            self.quarantine_row(context, row[context.id_position], 'transform', error_class, message, row,
+                                traceback_text)
+        if records and context.change_tracker is not None:
+            changed_records = context.change_tracker.changed_records(new_cursor, records, context.id_index)
+            context.rows_unchanged += len(records) - len(changed_records)
+            records = changed_records
+        if records:
+            started = time.perf_counter()
+            self.write_isolated(new_cursor, records, context)
+            if context.metrics is not None:
+                context.metrics.seconds['load'] += time.perf_counter() - started
+                context.metrics.bytes_written += context.metrics.estimate_bytes(records)
+        if rows:
+            context.last_seen_id = rows[-1][context.id_position]
+            if context.replayed_ids is not None:
+                context.replayed_ids.extend(row[context.id_position] for row in rows)
+        if context.commit_due():
+            self.commit_batch(new_cursor, context)
+
+    def write_isolated(self, new_cursor, records, context):
+        """
+        Writes records inside a savepoint. When the write fails the savepoint is
+        rolled back and the records are bisected until the failing rows are
+        isolated, so good rows keep going through at batch speed.
+        Args:
+            new_cursor: Cursor for the new database.
+            records: Transformed rows to write.
+            context: LoadContext of the mapping being processed.
+        """
+        new_cursor.execute("SAVEPOINT migrate_batch")
+        try:
+            inserted_ids = self.write_records(new_cursor, records, context)
+            new_cursor.execute("RELEASE SAVEPOINT migrate_batch")
+        except Exception as e:
+            new_cursor.execute("ROLLBACK TO SAVEPOINT migrate_batch")
+            new_cursor.execute("RELEASE SAVEPOINT migrate_batch")
+            if len(records) == 1:
+                self.handle_failed_row(records[0], e, context)
+                return
+            middle = len(records) // 2
+            self.write_isolated(new_cursor, records[:middle], context)
+            self.write_isolated(new_cursor, records[middle:], context)
+            return
+        context.uncommitted.extend(records)
+        context.inserted_ids.extend(inserted_ids)
+
+    def commit_batch(self, new_cursor, context):
+        """
+        Commits the open transaction of a mapping. If the commit itself fails,
+        the rows of that transaction are replayed one transaction per row.
+        Args:
+            new_cursor: Cursor for the new database.
+            context: LoadContext of the mapping being processed.
+        """
+        try:
+            if context.quarantine is not None:
+                # Same transaction as the rows: the old entries of the replayed rows go away
+                # and the rows that failed again are quarantined only when the batch is committed
+                if context.replayed_ids:
+                    context.quarantine.forget(new_cursor, context.quarantine_key, context.replayed_ids)
+                context.quarantine.write_pending(new_cursor, context.quarantined)
+            if context.change_tracker is not None:
+                context.change_tracker.write_pending(new_cursor, context.uncommitted)
+            if context.checkpoint_journal is not None:
+                # Same transaction as the rows, the checkpoint only moves when they are committed
+                context.checkpoint_journal.record(new_cursor, context.mapping_key, context.last_seen_id,
+                                                  context.rows_committed + len(context.uncommitted),
+                                                  context.rows_failed, 'running')
+            started = time.perf_counter()
+            new_cursor.connection.commit()
+            if context.metrics is not None:
+                context.metrics.observe_commit(time.perf_counter() - started)
+        except psycopg2.Error as e:
+            new_cursor.connection.rollback()
+            records = context.uncommitted
+            context.reset_transaction()
+            if len(records) <= 1:
+                if records:
+                    self.handle_failed_row(records[0], e, context)
+                    # Commits the quarantine entries and checkpoint without the row
+                    self.commit_batch(new_cursor, context)
+                return
+            logging.info(f"Commit to {context.new_table} failed, replaying {len(records)} rows one by one: {e}")
+            last_seen_id = context.last_seen_id
+            for record in records:
+                context.last_seen_id = record[context.id_position]
+                self.write_isolated(new_cursor, [record], context)
+                self.commit_batch(new_cursor, context)
+            context.last_seen_id = last_seen_id
+            return
+        if context.id_index is not None:
+            context.id_index.add_many(context.inserted_ids)
+        if context.change_tracker is not None:
+            context.change_tracker.forget_pending(context.uncommitted)
+        if context.quarantine is not None:
+            context.quarantine.write_committed(context.quarantined, context.quarantine_key,
+                                               context.replayed_ids)
+        context.quarantined = []
+        if context.replayed_ids is not None:
+            context.replayed_ids = []
+        context.rows_committed += len(context.uncommitted)
+        context.reset_transaction()
+
+    def handle_failed_row(self, record, error, context):
+        """
+        Reports a row that could not be written on its own.
+        Args:
+            record: Transformed row that failed.
+            error: Exception raised while writing it.
+            context: LoadContext of the mapping being processed.
+        """
+        self.quarantine_row(context, record[context.id_position], 'write', type(error).__name__, str(error).strip(),
+                            record)
+
+    def quarantine_row(self, context, record_id, stage, error_class, message, row=None, detail=None):
+        """
+        Counts a failed row, logs it through the rate-limited failure log and queues its
+        quarantine entry, written with the next commit.
+        Args:
+            context: LoadContext of the mapping being processed.
+            record_id: Source id of the row.
+            stage: 'transform' or 'write'.
+            error_class: Class name of the exception.
+            message: Message of the exception.
+            row: Source (transform) or transformed (write) row, stored as JSON.
+            detail: Optional traceback text.
+        """
+        context.rows_failed += 1
+        if context.failure_log is not None:
+            context.failure_log.report(error_class, message, record_id)
+        context.quarantined.append(Quarantine.entry(context.quarantine_key, context.old_table, context.new_table,
+                                                    record_id, stage, error_class, message, row, detail))
+
+    def write_records(self, new_cursor, records, context) -> List:
+        """
+        Writes records to the new table without committing.
+        Args:
+            new_cursor: Cursor for the new database.
+            records: Transformed rows to write.
+            context: LoadContext of the mapping being processed.
+        Returns:
+            Ids of the records that were inserted.
+        """
+        field_mappings = context.field_mappings
+        new_table = context.new_table
+        if self.load_mode == 'upsert':
+            self.upsert_records(new_cursor, records, context.plan)
+            return []
+        if self.load_mode == 'merge':
+            self.copy_new_records(new_cursor, records, context.plan, context.staging_table)
+            return []
+        pending_updates = []
+        pending_inserts = []
+        for record in records:
+            unique_id = record[context.id_position]
+            if context.id_index is not None:
+                exists = unique_id in context.id_index
+            else:
                 exists = self.check_existence_in_new_table(new_cursor, unique_id, new_table)
-                if exists:
-                    self.update_existing_record(new_cursor, data_row_trimmed, field_mappings, new_table, unique_id)
-                else:
-                    self.insert_new_record(new_cursor, data_row_trimmed, field_mappings, defaults, new_table)
-                # self.setup_auto_increment(new_db_conn, new_table, 'id')
-            except Exception as e:
-                logging.info(traceback.format_exc())
-                logging.info(f"Error processing row to {new_table}: {e}")
-                new_db_conn.rollback()
+            if exists:
+                pending_updates.append((record, unique_id))
+            else:
+                pending_inserts.append(record)
+        if pending_updates:
+            self.update_records(new_cursor, pending_updates, field_mappings, new_table)
+        if pending_inserts and self.load_mode == 'copy':
+            self.copy_new_records(new_cursor, pending_inserts, context.plan)
+        else:
+            for record in pending_inserts:
+                self.insert_new_record(new_cursor, record, field_mappings, context.defaults, new_table, commit=False)
+        return [record[context.id_position] for record in pending_inserts]
+
+    def upsert_records(self, new_cursor, data_rows, plan):
+        """
+        Inserts or overwrites a batch of records with multi-row
+        INSERT ... ON CONFLICT (id) DO UPDATE statements, without committing.
+        The result matches the per-row path: new records get their defaults,
+        existing records only get their mapped fields overwritten.
+        Args:
+            new_cursor: Cursor for the new database.
+            data_rows: Transformed rows to write.
+            plan: RowPlan of the mapping.
+        """
+        field_mappings = plan.field_mappings
+        defaults = plan.defaults
+        new_table = plan.new_table
+        # Deduplicate on id, a single statement may not touch the same row twice
+        records = {}
+        for data_row in data_rows:
+            records[data_row[plan.id_position]] = data_row
+        update_columns = [column for column in plan.mapped_columns if column != 'id']
+        # Mapped columns that also have a default are inserted with the default but updated
+        # with the mapped value, which EXCLUDED cannot express, so they are updated afterwards.
+        overridden_columns = [column for column in update_columns if column in defaults]
+        set_clause = ', '.join(f"{column} = EXCLUDED.{column}" for column in update_columns
+                               if column not in defaults)
+        conflict_action = f"DO UPDATE SET {set_clause}" if set_clause else "DO NOTHING"
+        upsert_query = (f"INSERT INTO {new_table} ({', '.join(plan.insert_columns)}) VALUES %s "
+                        f"ON CONFLICT (id) {conflict_action}")
+        if overridden_columns:
+            upsert_query += " RETURNING id, (xmax = 0) AS inserted"
+        result = execute_values(new_cursor, upsert_query,
+                                [plan.insert_values(data_row) for data_row in records.values()],
+                                page_size=self.upsert_page_size, fetch=bool(overridden_columns))
+        if overridden_columns:
+            inserted_ids = {record_id for record_id, inserted in result if inserted}
+            update_query = f"UPDATE {new_table} SET {', '.join(f'{column} = %s' for column in overridden_columns)} WHERE id = %s"
+            update_data = []
+            for record_id, data_row in records.items():
+                if record_id not in inserted_ids:
+                    mapped_row = {field['field_name_new']: value for field, value in zip(field_mappings, data_row)}
+                    update_data.append([mapped_row[column] for column in overridden_columns] + [record_id])
+            execute_batch(new_cursor, update_query, update_data, page_size=self.upsert_page_size)
+
+    def update_records(self, new_cursor, pending_updates, field_mappings, new_table):
+        """
+        Overwrites a batch of existing records in one round trip, without committing.
+        Args:
+            new_cursor: Cursor for the new database.
+            pending_updates: List of (transformed row, unique id) tuples.
+            field_mappings: List of field mappings.
+            new_table: Name of the new table.
+        """
+        update_fields = ', '.join([f"{field['field_name_new']} = %s" for field in field_mappings])
+        update_query = f"UPDATE {new_table} SET {update_fields} WHERE id = %s"
+        execute_batch(new_cursor, update_query,
+                      [list(data_row) + [unique_id] for data_row, unique_id in pending_updates],
+                      page_size=self.upsert_page_size)
+
+    def copy_new_records(self, new_cursor, pending_inserts, plan, staging_table=None):
+        """
+        Writes new records with a single COPY, without committing.
+        Args:
+            new_cursor: Cursor for the new database.
+            pending_inserts: Transformed rows to insert.
+            plan: RowPlan of the mapping.
+            staging_table: Optional StagingTable the records are written to instead of the new table.
+        """
+        target = staging_table or plan
+        columns = staging_table.columns if staging_table is not None else plan.insert_columns
+        values = staging_table.values if staging_table is not None else plan.insert_values
+        if target.copy_types is not None:
+            copy_buffer = BinaryCopyBuffer(columns, target.copy_types)
+        else:
+            copy_buffer = CopyBuffer(columns, self.get_column_types(plan.new_table, columns))
+        for data_row in pending_inserts:
+            copy_buffer.write_row(values(data_row))
+        copy_buffer.flush(new_cursor, staging_table.name if staging_table is not None else plan.new_table)
+
+    def get_column_types(self, table, columns):
+        """
+        Returns the type names of columns of the new schema, staged copies of a column
+        having its type; None when the schema was not loaded.
+        """
+        if self.new_schema is None:
+            return None
+        return [self.new_schema.column_type(table, column.removesuffix('__mapped')) for column in columns]
 
     def handle_data_type(self, value, data_type):
         handler_func = getattr(self.data_type_handler, data_type)
@@ -328,7 +1520,7 @@ class DataMigration:
         exists = new_cursor.fetchone()[0]
         return exists
 
-    def update_existing_record(self, new_cursor, update_row, field_mappings, new_table, unique_id):
+    def update_existing_record(self, new_cursor, update_row, field_mappings, new_table, unique_id, commit=True):
         """
         Updates an existing record in the new table.
 
@@ -338,34 +1530,53 @@ class DataMigration:
             field_mappings: List of field mappings.
             new_table: Name of the new table.
             unique_id: Unique identifier of the record.
+            commit: Commit the transaction after the update.
         """
         update_fields = ', '.join([f"{field['field_name_new']} = %s" for field in field_mappings])
         update_query = f"UPDATE {new_table} SET {update_fields} WHERE id = %s"
         update_data = list(update_row) + [unique_id]
         new_cursor.execute(update_query, update_data)
-        new_cursor.connection.commit()
+        if commit:
+            new_cursor.connection.commit()
 
-    def insert_new_record(self, new_cursor, update_row, field_mappings, defaults, new_table):
+    def build_insert_row(self, update_row, field_mappings, defaults) -> Dict:
         """
-        Inserts a new record into the new table.
+        Builds the column/value dictionary of a record to insert. Columns follow
+        the order of field_mappings, defaults overwrite mapped values and
+        unmapped defaults are appended at the end.
         Args:
-            new_cursor: Cursor for the new database.
             update_row: Data to insert.
             field_mappings: List of field mappings.
             defaults: Default values for fields.
-            new_table: Name of the new table.
+        Returns:
+            Dictionary of new column name to value.
         """
         # Create a dictionary from field_mappings and update_row
         update_row_dict = {field['field_name_new']: value for field, value in zip(field_mappings, update_row)}
         # Update the update_row_dict with default values, overwriting existing values
         for default_field, default_value in defaults.items():
             update_row_dict[default_field] = default_value
+        return update_row_dict
+
+    def insert_new_record(self, new_cursor, update_row, field_mappings, defaults, new_table, commit=True):
+        """
+        Inserts a new record into the new table.
+        Args:
+            new_cursor: Cursor for the new database.
+            update_row: Data to insert.
+            field_mappings: List of field mappings.
+            defaults: Default values for fields.
+            new_table: Name of the new table.
+            commit: Commit the transaction after the insert.
+        """
+        update_row_dict = self.build_insert_row(update_row, field_mappings, defaults)
         # Construct columns and placeholders for the INSERT query
         columns = ', '.join(update_row_dict.keys())
         placeholders = ', '.join(['%s'] * len(update_row_dict))
         insert_query = f"INSERT INTO {new_table} ({columns}) VALUES ({placeholders})"
         new_cursor.execute(insert_query, tuple(update_row_dict.values()))
-        new_cursor.connection.commit()
+        if commit:
+            new_cursor.connection.commit()
 
     def migrate_data(self, old_db_conn, new_db_conn, xml_name, mappings: List[Dict]):
         """
@@ -375,22 +1586,50 @@ class DataMigration:
             new_db_conn: Connection to the new database.
             xml_name: Name of the XML file.
             mappings: List of mappings containing information about models, field mappings, etc.
+        Returns:
+            Metrics of the migrated mappings.
         """
         logging.info("The data migration is processing...")
+        if self.checkpoint:
+            self.checkpoint_journal.ensure_table(new_db_conn)
+        self.quarantine.ensure_table(new_db_conn)
+        if self.track_changes:
+            ChangeTracker.ensure_table(new_db_conn)
+        if self.delta:
+            self.watermark_journal.ensure_table(new_db_conn)
+        if self.old_schema is None:
+            self.load_schemas(old_db_conn, new_db_conn)
+        fast_load_tables = []
+        if self.fast_load is not None:
+            self.fast_load.ensure_table(new_db_conn)
+            fast_load_tables = list(dict.fromkeys(
+                self.model_to_table(mapping_data['new_model']) for mapping_data in mappings
+                if self.new_schema.has_table(self.model_to_table(mapping_data['new_model']))))
+            for table in fast_load_tables:
+                self.fast_load.prepare(new_db_conn, table)
         old_cursor = old_db_conn.cursor()
         new_cursor = new_db_conn.cursor()
         max_id_per_table = {}  # Store the maximum ID per table
-        for mapping_data in mappings:
-            self.process_mapping_data(mapping_data, old_cursor, new_cursor, xml_name, old_db_conn, new_db_conn)
-            # Retrieve the maximum ID for the table after each mapping
-            max_id = self.get_max_id(new_cursor, self.model_to_table(mapping_data['new_model']))
-            max_id_per_table[self.model_to_table(mapping_data['new_model'])] = max_id
+        mapping_metrics = []
+        try:
+            for mapping_data in mappings:
+                mapping_metrics.append(self.run_mapping(mapping_data, old_cursor, new_cursor, xml_name,
+                                                        old_db_conn, new_db_conn))
+                # Retrieve the maximum ID for the table after each mapping, skipped mappings may lack it
+                new_table = self.model_to_table(mapping_data['new_model'])
+                if self.new_schema.has_table(new_table):
+                    max_id_per_table[new_table] = self.get_max_id(new_cursor, new_table)
+        finally:
+            if fast_load_tables:
+                new_db_conn.rollback()
+                self.restore_fast_load(new_db_conn, fast_load_tables)
         # After migrating all tables, setup auto-increment for each table
         for table, max_id in max_id_per_table.items():
             self.setup_auto_increment(new_db_conn, table, max_id)
         old_cursor.close()
         new_cursor.close()
         logging.info("The data migration is completed!")
+        return [metrics for metrics in mapping_metrics if metrics is not None]
 
     def get_max_id(self, cursor, table_name):
         query = f"SELECT MAX(id) FROM {table_name};"
@@ -454,12 +1693,122 @@ class DataMigration:
 
 # main
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate data from the old Odoo database to the new one.")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue every mapping from its last checkpoint instead of starting over")
+    parser.add_argument('--no-checkpoint', action='store_true', help="do not record progress in the new database")
+    parser.add_argument('--load-mode', choices=DataMigration.LOAD_MODES, default='copy',
+                        help="how records are written to the new database")
+    parser.add_argument('--workers', type=int, default=1, help="number of models migrated at the same time")
+    parser.add_argument('--partitions', type=int, default=1, help="number of id ranges per table processed in parallel")
+    parser.add_argument('--batch-size', type=int, default=2000, help="rows read and written per batch")
+    parser.add_argument('--itersize', type=int, default=2000, help="rows per round trip of the server-side cursor")
+    parser.add_argument('--no-stream', action='store_true', help="read source rows with a client-side cursor")
+    parser.add_argument('--commit-rows', type=int, default=10000, help="rows per transaction")
+    parser.add_argument('--commit-seconds', type=float, default=30.0, help="seconds per transaction")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="read, transform and write each table at the same time")
+    parser.add_argument('--transform-workers', type=int, default=2,
+                        help="transform processes per table in pipeline mode, 0 to transform in the reader thread")
+    parser.add_argument('--queue-size', type=int, default=8, help="batches in flight per table in pipeline mode")
+    parser.add_argument('--fast-load', choices=FastLoad.TRIGGER_MODES,
+                        help="skip triggers and foreign key checks and drop secondary indexes while loading "
+                             "(needs a superuser), then rebuild them, check foreign keys and ANALYZE")
+    parser.add_argument('--index-workers', type=int, default=4, help="indexes rebuilt at the same time after a fast load")
+    parser.add_argument('--restore-schema', action='store_true',
+                        help="only restore the triggers and indexes left suspended by a failed fast load run")
+    parser.add_argument('--report', default='migration_report.json',
+                        help="path of the JSON run report written at the end of the run")
+    parser.add_argument('--prometheus-textfile', help="path of a Prometheus textfile refreshed after every model")
+    parser.add_argument('--function-timings', action='store_true',
+                        help="time every DataTypeHandler conversion and processing function call")
+    parser.add_argument('--profile', nargs='?', const='cprofile', choices=MappingProfiler.MODES,
+                        help="profile every mapping (cprofile by default); transform processes of the pipeline "
+                             "mode are not profiled, use --transform-workers 0 to include them")
+    parser.add_argument('--profile-dir', default='profiles', help="directory of the .prof files")
+    parser.add_argument('--profile-top', type=int, default=20, help="functions listed in the run report per mapping")
+    parser.add_argument('--quarantine-file',
+                        help="append the failed rows to this JSONL file instead of the migration_quarantine table")
+    parser.add_argument('--replay-quarantine', action='store_true',
+                        help="migrate only the quarantined rows again, e.g. after fixing their mappings")
+    parser.add_argument('--error-log-interval', type=float, default=30.0,
+                        help="seconds between two summaries of the failed rows of a table")
+    parser.add_argument('--verify', action='store_true',
+                        help="only compare the mapped rows of the old and new databases with chunked checksums")
+    parser.add_argument('--verify-chunk-size', type=int, default=10000, help="ids hashed together when verifying")
+    parser.add_argument('--verify-sample', type=int, default=10,
+                        help="differing rows listed and compared column by column per mapping")
+    parser.add_argument('--verify-report', default='parity_report.json', help="path of the JSON parity report")
+    parser.add_argument('--no-pass-through', action='store_true',
+                        help="do not COPY untransformed mappings straight from the old table to an empty new one")
+    parser.add_argument('--binary-copy', action='store_true',
+                        help="write new records of every mapping with binary COPY (mappings can opt in "
+                             "with <binary_copy>true</binary_copy>)")
+    parser.add_argument('--track-changes', action='store_true',
+                        help="keep a content hash of every migrated row and only write new or changed rows")
+    parser.add_argument('--delta', action='store_true',
+                        help="only migrate rows modified since the last --delta run of each mapping (by write_date); "
+                             "run the initial load with --delta too so it records the marks")
+    parser.add_argument('--delta-overlap', type=float, default=0.0,
+                        help="seconds before the mark read again, for transactions committed late")
+    parser.add_argument('--compile-mappings', action='store_true',
+                        help="only compile models.xml and the mapping files into the mapping cache")
+    parser.add_argument('--check-schema', action='store_true',
+                        help="only report the tables and columns of the mappings missing in either database")
+    args = parser.parse_args()
+
     # Get the current working directory
     current_directory = os.path.dirname(os.path.abspath(__file__))
     # Construct paths relative to the current directory
     dm = DataMigration(
         connection_file='connection.json',
         models_xml_directory=os.path.join(current_directory),
-        mapping_directory=os.path.join(current_directory, "mappings")
+        mapping_directory=os.path.join(current_directory, "mappings"),
+        stream_rows=not args.no_stream,
+        itersize=args.itersize,
+        batch_size=args.batch_size,
+        load_mode=args.load_mode,
+        commit_rows=args.commit_rows,
+        commit_seconds=args.commit_seconds,
+        workers=args.workers,
+        partitions=args.partitions,
+        checkpoint=not args.no_checkpoint,
+        resume=args.resume,
+        pipeline=args.pipeline,
+        transform_workers=args.transform_workers,
+        queue_size=args.queue_size,
+        fast_load=args.fast_load,
+        index_workers=args.index_workers,
+        report_path=args.report,
+        prometheus_path=args.prometheus_textfile,
+        function_timings=args.function_timings,
+        profile=args.profile,
+        profile_directory=args.profile_dir,
+        profile_top=args.profile_top,
+        quarantine_file=args.quarantine_file,
+        replay_quarantine=args.replay_quarantine,
+        error_log_interval=args.error_log_interval,
+        pass_through=not args.no_pass_through,
+        binary_copy=args.binary_copy,
+        track_changes=args.track_changes,
+        delta=args.delta,
+        delta_overlap=args.delta_overlap,
     )
-    dm.migrate()
+    if args.compile_mappings:
+        logging.info(f"Compiled the mappings of {len(dm.compile_mappings())} models")
+    elif args.restore_schema:
+        new_db = dm.connect_to_db(dm.connection_data['new_db'])
+        dm.restore_fast_load(new_db)
+        new_db.close()
+    elif args.verify:
+        if dm.verify_parity(args.verify_chunk_size, args.verify_sample, args.verify_report):
+            raise SystemExit(1)
+    elif args.check_schema:
+        old_db = dm.connect_to_db(dm.connection_data['old_db'])
+        new_db = dm.connect_to_db(dm.connection_data['new_db'])
+        dm.load_schemas(old_db, new_db)
+        dm.check_schemas(dm.compile_mappings())
+        old_db.close()
+        new_db.close()
+    else:
+        dm.migrate()
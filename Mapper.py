@@ -1,5 +1,6 @@
 import os
 import json
+import argparse
 import xml.etree.ElementTree as ET
 import psycopg2  # PostgreSQL database adapter for Python
 import logging
@@ -243,8 +244,45 @@ class Mapper:
             else:
                 logging.info(f"Model '{model_info[0]}' does not exist in Skipping XML generation.")
 
+    def add_skips(self, xml_names=None, mapping_directory="mappings"):
+        """
+        Marks the fields that have no new field with a <skip/> element in the mapping files.
+        The loader ignores those fields on its own, this only documents them in the XML.
+        Args:
+            xml_names: Names of the mapping files to update, all files of the directory when empty.
+            mapping_directory: Directory holding the mapping files.
+        """
+        if not xml_names:
+            xml_names = [file_name[:-len(".xml")] for file_name in sorted(os.listdir(mapping_directory))
+                         if file_name.endswith(".xml")]
+        for xml_name in xml_names:
+            file_path = os.path.join(mapping_directory, f"{xml_name}.xml")
+            try:
+                tree = ET.parse(file_path)
+                updated = False
+                for mapping in tree.getroot().findall('mapping'):
+                    fields = mapping.find('fields')
+                    if fields is None:
+                        continue
+                    for field in fields.findall('field'):
+                        if field.find('new_field') is None and field.find('skip') is None:
+                            field.append(ET.Element('skip'))
+                            updated = True
+                if updated:
+                    tree.write(file_path)
+                    logging.info(f"Updated XML file: {file_path}")
+            except (OSError, ET.ParseError) as e:
+                logging.error(f"Error updating XML file {file_path}: {e}")
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the mapping files of the models listed in models.xml.")
+    parser.add_argument('--add-skips', nargs='*', metavar='XML_NAME',
+                        help="only mark the fields without a new field as skipped, in the given or all mapping files")
+    args = parser.parse_args()
     mapper = Mapper()
-    mapper._map()
+    if args.add_skips is not None:
+        mapper.add_skips(args.add_skips)
+    else:
+        mapper._map()
     logging.info('Mapping Ended!')
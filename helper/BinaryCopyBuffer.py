@@ -0,0 +1,228 @@
+import io
+import json
+import operator
+import struct
+from datetime import datetime
+from decimal import Decimal
+
+from helper.CopyBuffer import CopyBuffer
+
+POSTGRES_EPOCH = datetime(2000, 1, 1)
+POSTGRES_EPOCH_DATE = POSTGRES_EPOCH.date()
+
+_int16 = struct.Struct('>h')
+_int32 = struct.Struct('>i')
+_int64 = struct.Struct('>q')
+_float32 = struct.Struct('>f')
+_float64 = struct.Struct('>d')
+_numeric_header = struct.Struct('>hhHH')
+
+TRUE_TEXTS = ('t', 'true', 'y', 'yes', 'on', '1')
+FALSE_TEXTS = ('f', 'false', 'n', 'no', 'off', '0')
+
+
+def encode_bool(value) -> bytes:
+    # Only the values the text format accepts, anything else raises like a text COPY would
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text not in TRUE_TEXTS and text not in FALSE_TEXTS:
+            raise ValueError(f"invalid boolean: {value!r}")
+        value = text in TRUE_TEXTS
+    elif not isinstance(value, bool):
+        if value not in (0, 1) or isinstance(value, float):
+            raise ValueError(f"invalid boolean: {value!r}")
+        value = bool(value)
+    return b'\x01' if value else b'\x00'
+
+
+def to_integer(value) -> int:
+    """
+    Returns the integer of a value, raising where int() would truncate or coerce it.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"invalid integer: {value!r}")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        return int(value.strip())
+    if isinstance(value, (float, Decimal)):
+        if value != value or value in (float('inf'), float('-inf')) or value != int(value):
+            raise ValueError(f"invalid integer: {value!r}")
+        return int(value)
+    return operator.index(value)
+
+
+def encode_int2(value) -> bytes:
+    return _int16.pack(to_integer(value))
+
+
+def encode_int4(value) -> bytes:
+    return _int32.pack(to_integer(value))
+
+
+def encode_int8(value) -> bytes:
+    return _int64.pack(to_integer(value))
+
+
+def encode_float4(value) -> bytes:
+    return _float32.pack(float(value))
+
+
+def encode_float8(value) -> bytes:
+    return _float64.pack(float(value))
+
+
+def encode_numeric(value) -> bytes:
+    """
+    Encodes a number in the binary numeric format: digit count, weight, sign and
+    display scale, followed by the base 10000 digits.
+    """
+    if not isinstance(value, Decimal):
+        value = Decimal(repr(value) if isinstance(value, float) else str(value).strip())
+    if value.is_nan():
+        return _numeric_header.pack(0, 0, 0xC000, 0)
+    if value.is_infinite():  # PostgreSQL 14 and later
+        return _numeric_header.pack(0, 0, 0xF000 if value.is_signed() else 0xD000, 0)
+    sign, digits, exponent = value.as_tuple()
+    text = ''.join(map(str, digits))
+    if exponent > 0:
+        text += '0' * exponent
+        exponent = 0
+    integer_length = len(text) + exponent
+    # Align the decimal point on a group of 4 digits on both sides
+    left_padding = -integer_length % 4
+    text = '0' * left_padding + text + '0' * (exponent % 4)
+    integer_length += left_padding
+    groups = [int(text[index:index + 4]) for index in range(0, len(text), 4)]
+    weight = integer_length // 4 - 1
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+    header = _numeric_header.pack(len(groups), weight, 0x4000 if sign and groups else 0, -exponent)
+    return header + struct.pack(f'>{len(groups)}H', *groups)
+
+
+def encode_timestamp(value) -> bytes:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip())
+    elif not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    # Like the text format, an offset is ignored by timestamp without time zone
+    delta = value.replace(tzinfo=None) - POSTGRES_EPOCH
+    return _int64.pack(delta.days * 86400000000 + delta.seconds * 1000000 + delta.microseconds)
+
+
+def encode_date(value) -> bytes:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip())
+    if isinstance(value, datetime):
+        value = value.date()
+    return _int32.pack((value - POSTGRES_EPOCH_DATE).days)
+
+
+def encode_text(value) -> bytes:
+    return CopyBuffer.text_value(value).encode()
+
+
+def encode_json(value) -> bytes:
+    if isinstance(value, list):
+        return json.dumps(value).encode()
+    return CopyBuffer.text_value(value).encode()
+
+
+def encode_jsonb(value) -> bytes:
+    # Version 1 of the jsonb binary format is its text
+    return b'\x01' + encode_json(value)
+
+
+class BinaryCopyBuffer:
+    """
+    In-memory buffer holding rows encoded in PostgreSQL's binary COPY format,
+    from the type of every target column, so the server does not parse the values.
+    Used like CopyBuffer, for tables whose columns all have an encoder.
+    """
+
+    # Encoders per type name (udt_name of information_schema.columns)
+    ENCODERS = {
+        'bool': encode_bool,
+        'int2': encode_int2,
+        'int4': encode_int4,
+        'int8': encode_int8,
+        'float4': encode_float4,
+        'float8': encode_float8,
+        'numeric': encode_numeric,
+        'timestamp': encode_timestamp,
+        'date': encode_date,
+        'varchar': encode_text,
+        'bpchar': encode_text,
+        'text': encode_text,
+        'json': encode_json,
+        'jsonb': encode_jsonb,
+    }
+    HEADER = b'PGCOPY\n\xff\r\n\x00' + _int32.pack(0) + _int32.pack(0)
+    TRAILER = _int16.pack(-1)
+    NULL = _int32.pack(-1)
+
+    def __init__(self, columns: list, column_types: list):
+        """
+        Args:
+            columns: Names of the target columns.
+            column_types: Type names of the columns, in the same order, all supported.
+        """
+        self.columns = list(columns)
+        self.encoders = [self.ENCODERS[column_type] for column_type in column_types]
+        self.field_count = _int16.pack(len(self.columns))
+        self.parts = []
+        self.row_count = 0
+
+    def __len__(self):
+        return self.row_count
+
+    @classmethod
+    def unsupported_types(cls, column_types: list) -> list:
+        """
+        Returns the column types without encoder, the table then has to use the text format.
+        """
+        return [column_type for column_type in column_types if column_type not in cls.ENCODERS]
+
+    def write_row(self, values):
+        """
+        Appends one row to the buffer. An invalid value raises before anything is added.
+        Args:
+            values: Values in the same order as `columns`.
+        """
+        fields = [self.field_count]
+        for value, encoder in zip(values, self.encoders):
+            if value is None:
+                fields.append(self.NULL)
+            else:
+                data = encoder(value)
+                fields.append(_int32.pack(len(data)))
+                fields.append(data)
+        self.parts.append(b''.join(fields))
+        self.row_count += 1
+
+    def flush(self, cursor, table: str) -> int:
+        """
+        Sends the buffered rows to the given table and empties the buffer.
+        The caller is responsible for committing the transaction.
+        Args:
+            cursor: Cursor for the target database.
+            table: Name of the target table.
+        Returns:
+            Number of rows sent.
+        """
+        row_count = self.row_count
+        if row_count:
+            data = io.BytesIO(b''.join([self.HEADER, *self.parts, self.TRAILER]))
+            cursor.copy_expert(f"COPY {table} ({', '.join(self.columns)}) FROM STDIN WITH (FORMAT binary)", data)
+        self.clear()
+        return row_count
+
+    def clear(self):
+        self.parts = []
+        self.row_count = 0
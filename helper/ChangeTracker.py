@@ -0,0 +1,127 @@
+import hashlib
+
+from psycopg2.extras import execute_values
+
+from helper.CopyBuffer import CopyBuffer
+
+
+class ChangeTracker:
+    """
+    Content hashes of the rows a mapping wrote, kept in a side table of the new
+    database. Before a batch is written its hashes are compared with the stored
+    ones in one query, and rows that did not change since the last run are left
+    out. The hashes of written rows are stored in the same transaction as the rows;
+    in merge mode they are staged alongside the rows and stored by the merge.
+    """
+
+    TABLE = 'migration_row_hash'
+
+    def __init__(self, mapping_key: str, plan):
+        """
+        Args:
+            mapping_key: Key of the mapping, the hashes of each mapping are kept apart.
+            plan: RowPlan of the mapping.
+        """
+        self.mapping_key = mapping_key
+        self.plan = plan
+        # Part of every hash, so changing the columns or defaults of the mapping rewrites its rows
+        self.signature = '\t'.join(plan.insert_columns) + '\n'
+        # {id: hash} of the rows written but not committed yet
+        self.pending = {}
+        # UNLOGGED table the hashes are written to until the merge, in merge mode
+        self.staging_name = None
+
+    @classmethod
+    def ensure_table(cls, conn):
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {cls.TABLE} (
+                    mapping_key varchar NOT NULL,
+                    record_id bigint NOT NULL,
+                    row_hash varchar NOT NULL,
+                    PRIMARY KEY (mapping_key, record_id)
+                )
+            """)
+        conn.commit()
+
+    def stage(self, cursor, staging_name: str, keep: bool = False):
+        """
+        Writes the hashes to an UNLOGGED staging table, stored by merge_staged only.
+        Args:
+            cursor: Cursor for the new database.
+            staging_name: Name of the staging table of the rows.
+            keep: Keep the hashes of an existing staging table, when resuming the mapping.
+        """
+        self.staging_name = staging_name[:54] + '_row_hash'
+        if not keep:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.staging_name}")
+        cursor.execute(f"CREATE UNLOGGED TABLE IF NOT EXISTS {self.staging_name} "
+                       f"(record_id bigint NOT NULL, row_hash varchar NOT NULL)")
+
+    def merge_staged(self, cursor):
+        """
+        Stores the staged hashes and drops their staging table, without committing.
+        """
+        cursor.execute(f"INSERT INTO {self.TABLE} (mapping_key, record_id, row_hash) "
+                       f"SELECT DISTINCT ON (record_id) %s, record_id, row_hash FROM {self.staging_name} "
+                       f"ORDER BY record_id, ctid DESC "
+                       f"ON CONFLICT (mapping_key, record_id) DO UPDATE SET row_hash = EXCLUDED.row_hash",
+                       (self.mapping_key,))
+        cursor.execute(f"DROP TABLE {self.staging_name}")
+
+    def discard_staged(self, cursor, record_id):
+        """
+        Removes the staged hashes of a record that could not be merged.
+        """
+        cursor.execute(f"DELETE FROM {self.staging_name} WHERE record_id = %s", (record_id,))
+
+    def row_hash(self, record) -> str:
+        """
+        Hashes the values a transformed row writes, defaults included, in their COPY text form.
+        """
+        text = self.signature + '\t'.join([CopyBuffer.encode_value(value) for value in self.plan.insert_values(record)])
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def changed_records(self, cursor, records, id_index=None) -> list:
+        """
+        Returns the records that are new or changed since their hash was stored.
+        Args:
+            cursor: Cursor for the new database.
+            records: Transformed rows.
+            id_index: Optional IdIndex of the target, records missing from it are always written.
+        """
+        id_position = self.plan.id_position
+        hashes = {record[id_position]: self.row_hash(record) for record in records}
+        cursor.execute(f"SELECT record_id, row_hash FROM {self.TABLE} WHERE mapping_key = %s AND record_id = ANY(%s)",
+                       (self.mapping_key, list(hashes)))
+        stored = dict(cursor.fetchall())
+        changed = []
+        for record in records:
+            record_id = record[id_position]
+            if stored.get(record_id) != hashes[record_id] or (id_index is not None and record_id not in id_index):
+                changed.append(record)
+                self.pending[record_id] = hashes[record_id]
+        return changed
+
+    def write_pending(self, cursor, records):
+        """
+        Stores the hashes of written records inside the open transaction.
+        """
+        id_position = self.plan.id_position
+        rows = [(self.mapping_key, record[id_position], self.pending[record[id_position]]) for record in records
+                if record[id_position] in self.pending]
+        if rows and self.staging_name is not None:
+            execute_values(cursor, f"INSERT INTO {self.staging_name} (record_id, row_hash) VALUES %s",
+                           [row[1:] for row in rows])
+        elif rows:
+            execute_values(cursor, f"INSERT INTO {self.TABLE} (mapping_key, record_id, row_hash) VALUES %s "
+                                   f"ON CONFLICT (mapping_key, record_id) DO UPDATE SET row_hash = EXCLUDED.row_hash",
+                           rows)
+
+    def forget_pending(self, records):
+        """
+        Drops the pending hashes of committed records.
+        """
+        id_position = self.plan.id_position
+        for record in records:
+            self.pending.pop(record[id_position], None)
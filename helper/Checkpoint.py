@@ -0,0 +1,61 @@
+import json
+
+
+class CheckpointJournal:
+    """
+    Progress journal of the migration, kept in a side table of the new database.
+    Checkpoints are written in the same transaction as the rows they describe,
+    so the journal never claims more than what was committed.
+    """
+
+    TABLE = 'migration_checkpoint'
+
+    def ensure_table(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                    mapping_key varchar PRIMARY KEY,
+                    last_id bigint,
+                    rows_committed bigint NOT NULL DEFAULT 0,
+                    rows_failed bigint NOT NULL DEFAULT 0,
+                    status varchar NOT NULL,
+                    id_ranges text,
+                    updated_at timestamp NOT NULL DEFAULT now()
+                )
+            """)
+        conn.commit()
+
+    def load(self, cursor, mapping_key: str):
+        """
+        Returns the checkpoint of a mapping as a dictionary, None when there is none.
+        """
+        cursor.execute(f"SELECT last_id, rows_committed, rows_failed, status, id_ranges "
+                       f"FROM {self.TABLE} WHERE mapping_key = %s", (mapping_key,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return {
+            'last_id': row[0],
+            'rows_committed': row[1],
+            'rows_failed': row[2],
+            'status': row[3],
+            'id_ranges': [tuple(id_range) for id_range in json.loads(row[4])] if row[4] else None,
+        }
+
+    def record(self, cursor, mapping_key: str, last_id, rows_committed: int, rows_failed: int, status: str,
+               id_ranges=None):
+        """
+        Writes the checkpoint of a mapping, the caller commits it.
+        """
+        cursor.execute(f"""
+            INSERT INTO {self.TABLE} (mapping_key, last_id, rows_committed, rows_failed, status, id_ranges, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, now())
+            ON CONFLICT (mapping_key) DO UPDATE SET
+                last_id = EXCLUDED.last_id,
+                rows_committed = EXCLUDED.rows_committed,
+                rows_failed = EXCLUDED.rows_failed,
+                status = EXCLUDED.status,
+                id_ranges = COALESCE(EXCLUDED.id_ranges, {self.TABLE}.id_ranges),
+                updated_at = EXCLUDED.updated_at
+        """, (mapping_key, last_id, rows_committed, rows_failed, status,
+              json.dumps(id_ranges) if id_ranges is not None else None))
@@ -0,0 +1,121 @@
+import io
+import json
+import re
+from datetime import date, datetime, time
+
+# Array elements that have to be double-quoted: empty, NULL, or holding a delimiter, quote, brace or space
+ARRAY_QUOTED = re.compile(r'^$|^null$|[{}",\\\s]', re.IGNORECASE)
+# Types whose values are written as JSON, lists included
+JSON_TYPES = ('json', 'jsonb')
+
+
+class CopyBuffer:
+    """
+    In-memory buffer holding rows encoded in PostgreSQL's COPY text format.
+    Rows are written one by one by the pipeline and sent to the database in one
+    `COPY ... FROM STDIN` when the buffer is flushed.
+    """
+
+    # Characters that have a special meaning in the COPY text format
+    ESCAPES = str.maketrans({'\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+    def __init__(self, columns: list, column_types: list = None):
+        """
+        Args:
+            columns: Names of the target columns.
+            column_types: Optional type names of the columns, lists are written as JSON to json and jsonb columns.
+        """
+        self.columns = list(columns)
+        self.json_positions = [index for index, column_type in enumerate(column_types or []) if column_type in JSON_TYPES]
+        self.buffer = io.StringIO()
+        self.row_count = 0
+
+    def __len__(self):
+        return self.row_count
+
+    @classmethod
+    def encode_value(cls, value) -> str:
+        """
+        Encodes a single Python value as a COPY text field.
+        Args:
+            value: Value to encode.
+        Returns:
+            The escaped field text, `\\N` for NULL.
+        """
+        if value is None:
+            return '\\N'
+        return cls.text_value(value).translate(cls.ESCAPES)
+
+    @staticmethod
+    def text_value(value) -> str:
+        """
+        Returns the text PostgreSQL parses a non-NULL Python value from, before COPY escaping.
+        """
+        if isinstance(value, str):
+            return value
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        if isinstance(value, (datetime, date, time)):
+            return value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+        if isinstance(value, dict):
+            return json.dumps(value)
+        if isinstance(value, list):
+            return CopyBuffer.array_literal(value)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return '\\x' + bytes(value).hex()
+        return str(value)
+
+    @staticmethod
+    def array_literal(values) -> str:
+        """
+        Returns the array literal of a Python list, `{1,2}` or `{"a b",NULL}`; nested lists give multidimensional arrays.
+        """
+        elements = []
+        for value in values:
+            if value is None:
+                elements.append('NULL')
+            elif isinstance(value, list):
+                elements.append(CopyBuffer.array_literal(value))
+            else:
+                text = CopyBuffer.text_value(value)
+                if ARRAY_QUOTED.search(text):
+                    text = '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+                elements.append(text)
+        return '{' + ','.join(elements) + '}'
+
+    def write_row(self, values):
+        """
+        Appends one row to the buffer.
+        Args:
+            values: Values in the same order as `columns`.
+        """
+        if self.json_positions:
+            values = list(values)
+            for position in self.json_positions:
+                if isinstance(values[position], list):
+                    values[position] = json.dumps(values[position])
+        self.buffer.write('\t'.join([self.encode_value(value) for value in values]))
+        self.buffer.write('\n')
+        self.row_count += 1
+
+    def flush(self, cursor, table: str) -> int:
+        """
+        Sends the buffered rows to the given table and empties the buffer.
+        The caller is responsible for committing the transaction.
+        Args:
+            cursor: Cursor for the target database.
+            table: Name of the target table.
+        Returns:
+            Number of rows sent.
+        """
+        row_count = self.row_count
+        if row_count:
+            self.buffer.seek(0)
+            columns = ', '.join(self.columns)
+            cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN", self.buffer)
+        self.clear()
+        return row_count
+
+    def clear(self):
+        self.buffer = io.StringIO()
+        self.row_count = 0
@@ -0,0 +1,103 @@
+import queue
+import threading
+
+
+class CopyPipe:
+    """
+    Streams the output of a `COPY (SELECT ...) TO STDOUT` on one connection into
+    a `COPY ... FROM STDIN` on another. A thread runs the COPY TO and passes the
+    raw COPY data through a bounded queue of chunks, which the COPY FROM reads in
+    the calling thread; rows are never parsed into Python values.
+    """
+
+    _END = object()
+
+    def __init__(self, chunk_size: int = 1 << 20, queue_size: int = 16):
+        """
+        Args:
+            chunk_size: Bytes passed from one COPY to the other at once.
+            queue_size: Maximum number of chunks in flight.
+        """
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=queue_size)
+        self.stop = threading.Event()
+        self.pending = bytearray()
+        self.current = memoryview(b'')
+        self.finished = False
+        self.bytes_copied = 0
+
+    # File interface of the COPY TO side, called by psycopg2 with the data of every row
+    def write(self, data):
+        if self.stop.is_set():
+            raise RuntimeError("COPY pipe closed by the reading side")
+        self.pending += data if isinstance(data, (bytes, bytearray)) else data.encode()
+        if len(self.pending) >= self.chunk_size:
+            self.put(bytes(self.pending))
+            self.pending = bytearray()
+
+    def put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    # File interface of the COPY FROM side
+    def read(self, size=-1):
+        while not self.current:
+            if self.finished:
+                return b''
+            item = self.chunks.get()
+            if item is self._END:
+                self.finished = True
+                return b''
+            self.current = memoryview(item)
+        if size is None or size < 0:
+            size = len(self.current)
+        data = bytes(self.current[:size])
+        self.current = self.current[size:]
+        self.bytes_copied += len(data)
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+    def run(self, source_cursor, copy_to: str, target_cursor, copy_from: str) -> int:
+        """
+        Runs both COPY statements. Neither connection is committed.
+        Args:
+            source_cursor: Cursor on the connection the rows are read from.
+            copy_to: The `COPY (...) TO STDOUT` statement.
+            target_cursor: Cursor on the connection the rows are written to.
+            copy_from: The `COPY ... FROM STDIN` statement.
+        Returns:
+            Number of rows written.
+        """
+        errors = []
+
+        def produce():
+            try:
+                source_cursor.copy_expert(copy_to, self, size=self.chunk_size)
+                if self.pending:
+                    self.put(bytes(self.pending))
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                self.put(self._END)
+
+        producer = threading.Thread(target=produce, name='copy-pipe', daemon=True)
+        producer.start()
+        try:
+            target_cursor.copy_expert(copy_from, self, size=self.chunk_size)
+        except BaseException:
+            # Stop the COPY TO instead of reading the rest of the table
+            self.stop.set()
+            source_cursor.connection.cancel()
+            raise
+        finally:
+            producer.join()
+        if errors:
+            # The COPY FROM received only part of the rows, the caller rolls it back
+            raise errors[0]
+        return target_cursor.rowcount
@@ -0,0 +1,196 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from psycopg2 import sql
+
+
+class FastLoad:
+    """
+    Suspends the triggers and secondary indexes of the tables being loaded and
+    restores them afterwards. Every change is recorded in a side table of the new
+    database in the same transaction that makes it, so whatever a crashed run
+    dropped or disabled can always be restored from that table.
+    """
+
+    TABLE = 'migration_fast_load'
+    # 'replica': the loading sessions run with session_replication_role = replica, which skips
+    # triggers and foreign key checks without touching the tables.
+    # 'disable': ALTER TABLE ... DISABLE TRIGGER ALL on every loaded table, recorded and undone afterwards.
+    # Both need a superuser on the new database.
+    TRIGGER_MODES = ('replica', 'disable')
+
+    # Indexes that neither back the primary key nor a constraint can be dropped and rebuilt freely
+    INDEX_QUERY = """
+        SELECT index_class.relname, pg_get_indexdef(pg_index.indexrelid)
+        FROM pg_index
+        JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+        WHERE pg_index.indrelid = %s::regclass
+          AND NOT pg_index.indisprimary
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE pg_constraint.conindid = pg_index.indexrelid)
+        ORDER BY index_class.relname
+    """
+
+    FOREIGN_KEY_QUERY = """
+        SELECT constraint_.conname, constraint_.confrelid::regclass::text,
+               array_agg(column_.attname::text ORDER BY key.position),
+               array_agg(foreign_column.attname::text ORDER BY key.position)
+        FROM pg_constraint constraint_
+        CROSS JOIN LATERAL unnest(constraint_.conkey, constraint_.confkey)
+            WITH ORDINALITY AS key(attnum, foreign_attnum, position)
+        JOIN pg_attribute column_ ON column_.attrelid = constraint_.conrelid AND column_.attnum = key.attnum
+        JOIN pg_attribute foreign_column ON foreign_column.attrelid = constraint_.confrelid
+                                        AND foreign_column.attnum = key.foreign_attnum
+        WHERE constraint_.conrelid = %s::regclass AND constraint_.contype = 'f'
+        GROUP BY constraint_.conname, constraint_.confrelid
+    """
+
+    def __init__(self, trigger_mode: str = 'replica', index_workers: int = 4):
+        if trigger_mode not in self.TRIGGER_MODES:
+            raise ValueError(f"Unknown trigger mode: {trigger_mode}")
+        self.trigger_mode = trigger_mode
+        self.index_workers = index_workers
+
+    def ensure_table(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                    table_name varchar NOT NULL,
+                    object_name varchar NOT NULL,
+                    kind varchar NOT NULL,
+                    definition text,
+                    recorded_at timestamp NOT NULL DEFAULT now(),
+                    PRIMARY KEY (table_name, kind, object_name)
+                )
+            """)
+        conn.commit()
+
+    def prepare_connection(self, conn):
+        """
+        Puts a loading session in replica mode when that is the trigger mode.
+        """
+        if self.trigger_mode == 'replica':
+            with conn.cursor() as cursor:
+                cursor.execute("SET session_replication_role = replica")
+            conn.commit()
+
+    def prepare(self, conn, table: str):
+        """
+        Disables the triggers of a table (in 'disable' mode) and drops its secondary
+        indexes, recording each change in the same transaction as the change itself.
+        Args:
+            conn: Connection to the new database.
+            table: Name of the table about to be loaded.
+        """
+        with conn.cursor() as cursor:
+            if self.trigger_mode == 'disable':
+                self.record(cursor, table, 'ALL', 'triggers')
+                cursor.execute(sql.SQL("ALTER TABLE {} DISABLE TRIGGER ALL").format(sql.Identifier(table)))
+                conn.commit()
+            cursor.execute(self.INDEX_QUERY, (table,))
+            indexes = cursor.fetchall()
+            for index_name, definition in indexes:
+                self.record(cursor, table, index_name, 'index', definition)
+                cursor.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(index_name)))
+                conn.commit()
+        logging.info(f"Fast load of {table}: dropped {len(indexes)} indexes"
+                     + (", disabled triggers" if self.trigger_mode == 'disable' else ""))
+
+    def record(self, cursor, table: str, object_name: str, kind: str, definition=None):
+        cursor.execute(f"INSERT INTO {self.TABLE} (table_name, object_name, kind, definition) "
+                       f"VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING", (table, object_name, kind, definition))
+
+    def pending_tables(self, conn) -> list:
+        """
+        Returns the tables with triggers or indexes still to restore, e.g. after a crashed run.
+        """
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT DISTINCT table_name FROM {self.TABLE} ORDER BY table_name")
+            tables = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        return tables
+
+    def restore(self, conn, tables, connect) -> dict:
+        """
+        Re-enables the triggers of the tables, rebuilds their dropped indexes in
+        parallel, checks their foreign keys and runs ANALYZE. A change is only
+        removed from the side table once it has been undone, so a failed restore
+        can be run again.
+        Args:
+            conn: Connection to the new database.
+            tables: Names of the tables to restore.
+            connect: Callable returning a new connection to the new database, one per index build.
+        Returns:
+            Dictionary of constraint name to the number of rows violating it.
+        """
+        tables = list(tables)
+        if not tables:
+            return {}
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT table_name, object_name, kind, definition FROM {self.TABLE} "
+                           f"WHERE table_name = ANY(%s)", (tables,))
+            records = cursor.fetchall()
+            for table, object_name, kind, _ in records:
+                if kind == 'triggers':
+                    cursor.execute(sql.SQL("ALTER TABLE {} ENABLE TRIGGER ALL").format(sql.Identifier(table)))
+                    self.forget(cursor, table, object_name, kind)
+                    conn.commit()
+        conn.commit()
+        indexes = [(table, object_name, definition) for table, object_name, kind, definition in records
+                   if kind == 'index']
+        if indexes:
+            with ThreadPoolExecutor(max_workers=self.index_workers) as executor:
+                futures = {executor.submit(self.rebuild_index, connect, *index): index for index in indexes}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logging.error(f"Rebuilding index {futures[future][1]} of {futures[future][0]} failed, "
+                                      f"it stays recorded in {self.TABLE}: {e}")
+        violations = {}
+        for table in tables:
+            violations.update(self.check_foreign_keys(conn, table))
+            with conn.cursor() as cursor:
+                cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+            conn.commit()
+        logging.info(f"Fast load restored {len(indexes)} indexes of {len(tables)} tables")
+        return violations
+
+    def rebuild_index(self, connect, table: str, index_name: str, definition: str):
+        conn = connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(definition)
+                self.forget(cursor, table, index_name, 'index')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def forget(self, cursor, table: str, object_name: str, kind: str):
+        cursor.execute(f"DELETE FROM {self.TABLE} WHERE table_name = %s AND object_name = %s AND kind = %s",
+                       (table, object_name, kind))
+
+    def check_foreign_keys(self, conn, table: str) -> dict:
+        """
+        Counts the rows of a table whose foreign keys point to missing rows, which
+        triggers would have rejected during a normal load.
+        Returns:
+            Dictionary of constraint name to the number of violating rows, violations only.
+        """
+        violations = {}
+        with conn.cursor() as cursor:
+            cursor.execute(self.FOREIGN_KEY_QUERY, (table,))
+            for constraint_name, foreign_table, columns, foreign_columns in cursor.fetchall():
+                not_null = sql.SQL(' AND ').join(
+                    sql.SQL("child.{} IS NOT NULL").format(sql.Identifier(column)) for column in columns)
+                matches = sql.SQL(' AND ').join(
+                    sql.SQL("parent.{} = child.{}").format(sql.Identifier(foreign_column), sql.Identifier(column))
+                    for column, foreign_column in zip(columns, foreign_columns))
+                cursor.execute(sql.SQL("SELECT count(*) FROM {} child WHERE {} AND NOT EXISTS "
+                                       "(SELECT 1 FROM {} parent WHERE {})").format(
+                    sql.Identifier(table), not_null, sql.SQL(foreign_table), matches))
+                count = cursor.fetchone()[0]
+                if count:
+                    violations[constraint_name] = count
+                    logging.warning(f"{count} rows of {table} violate foreign key {constraint_name}")
+        conn.commit()
+        return violations
@@ -0,0 +1,152 @@
+from array import array
+from bisect import bisect_left
+
+
+class IdIndex:
+    """
+    Compact in-memory set of the record ids present in a table.
+    Dense id ranges are stored as a bitmap (one bit per possible id), sparse
+    ones as sorted arrays('q') searched with bisect. Ids added after loading
+    are kept in a small set and flushed as a new sorted run once it grows large:
+    ids above every stored id are appended to the last run, other runs are merged
+    whenever a run is at least half the size of the one before it, so there are
+    O(log n) runs and each id is merged O(log n) times. Once the ids turn out to
+    be dense, the runs are replaced by a bitmap.
+    """
+
+    # A bitmap is used when it needs fewer bytes than the sorted array (8 bytes per id)
+    BITMAP_DENSITY = 64
+
+    def __init__(self, sorted_ids=None, merge_threshold: int = 100000):
+        self.merge_threshold = merge_threshold
+        self.pending = set()
+        # Sorted runs of disjoint ids, each at most half the size of the one before it
+        self.runs = []
+        self.bitmap = None
+        self.offset = 0
+        sorted_ids = sorted_ids if sorted_ids is not None else array('q')
+        if sorted_ids and self.use_bitmap(sorted_ids[0], sorted_ids[-1], len(sorted_ids)):
+            self.build_bitmap([sorted_ids])
+        elif sorted_ids:
+            self.runs = [sorted_ids]
+        self.count = len(sorted_ids)
+
+    def use_bitmap(self, first_id, last_id, count) -> bool:
+        return (last_id - first_id + 1) <= count * self.BITMAP_DENSITY
+
+    def build_bitmap(self, runs):
+        self.offset = min(run[0] for run in runs)
+        self.bitmap = bytearray(((max(run[-1] for run in runs) - self.offset) >> 3) + 1)
+        for run in runs:
+            for record_id in run:
+                position = record_id - self.offset
+                self.bitmap[position >> 3] |= 1 << (position & 7)
+        self.runs = []
+
+    @classmethod
+    def load(cls, conn, table: str, chunk_size: int = 100000, lower=None, upper=None):
+        """
+        Reads all ids of a table in chunks through a server-side cursor.
+        Args:
+            conn: Connection to the database holding the table.
+            table: Name of the table.
+            chunk_size: Number of ids fetched per round trip.
+            lower: Optional inclusive lower bound of the ids to read.
+            upper: Optional exclusive upper bound of the ids to read.
+        Returns:
+            IdIndex holding the ids of the table.
+        """
+        ids = array('q')
+        conditions = []
+        params = []
+        if lower is not None:
+            conditions.append("id >= %s")
+            params.append(lower)
+        if upper is not None:
+            conditions.append("id < %s")
+            params.append(upper)
+        where_clause = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with conn.cursor(name=f"id_index_{table}") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(f"SELECT id FROM {table}{where_clause} ORDER BY id", params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                ids.extend(row[0] for row in rows)
+        conn.commit()
+        return cls(ids)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, record_id) -> bool:
+        if record_id is None:
+            return False
+        if self.bitmap is not None:
+            position = record_id - self.offset
+            # Ids added before the bitmap grew over them may still be pending
+            if 0 <= position < len(self.bitmap) << 3 and self.bitmap[position >> 3] & (1 << (position & 7)):
+                return True
+        for run in self.runs:
+            if run[0] <= record_id <= run[-1]:
+                index = bisect_left(run, record_id)
+                if run[index] == record_id:
+                    return True
+        return record_id in self.pending
+
+    def add(self, record_id):
+        if record_id is None or record_id in self:
+            return
+        self.count += 1
+        position = record_id - self.offset
+        if self.bitmap is not None and 0 <= position < self.count * self.BITMAP_DENSITY:
+            missing_bytes = (position >> 3) + 1 - len(self.bitmap)
+            if missing_bytes > 0:
+                self.bitmap.extend(bytes(missing_bytes))
+            self.bitmap[position >> 3] |= 1 << (position & 7)
+            return
+        self.pending.add(record_id)
+        if self.bitmap is None and len(self.pending) >= self.merge_threshold:
+            self.flush_pending()
+
+    def add_many(self, record_ids):
+        for record_id in record_ids:
+            self.add(record_id)
+
+    @staticmethod
+    def merge_runs(larger, smaller):
+        """
+        Merges two sorted runs of disjoint ids into a new array, copying the ids of the
+        larger run between two ids of the smaller one as array slices.
+        """
+        merged = array('q')
+        start = 0
+        for record_id in smaller:
+            end = bisect_left(larger, record_id, start)
+            if end > start:
+                merged.extend(larger[start:end])
+            merged.append(record_id)
+            start = end
+        merged.extend(larger[start:])
+        return merged
+
+    def flush_pending(self):
+        """
+        Moves the pending ids to the sorted runs, or to a bitmap once the ids are dense.
+        """
+        new_run = array('q', sorted(self.pending))
+        self.pending = set()
+        last_run = max(self.runs, key=lambda run: run[-1], default=None)
+        if last_run is not None and last_run[-1] < new_run[0]:
+            # Ids above every stored id, the common case of a growing table
+            last_run.extend(new_run)
+        else:
+            self.runs.append(new_run)
+        self.runs.sort(key=len, reverse=True)
+        while len(self.runs) > 1 and len(self.runs[-1]) * 2 >= len(self.runs[-2]):
+            smaller = self.runs.pop()
+            self.runs[-1] = self.merge_runs(self.runs[-1], smaller)
+        if self.use_bitmap(min(run[0] for run in self.runs), max(run[-1] for run in self.runs),
+                           sum(len(run) for run in self.runs)):
+            self.build_bitmap(self.runs)
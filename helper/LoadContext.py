@@ -0,0 +1,60 @@
+import time
+
+
+class LoadContext:
+    """
+    State of one mapping while it is being written to the new database:
+    what to write, and which rows and ids belong to the open transaction.
+    """
+
+    def __init__(self, plan, id_index=None, commit_rows: int = 10000, commit_seconds: float = 30.0):
+        self.plan = plan
+        self.new_table = plan.new_table
+        self.field_mappings = plan.field_mappings
+        self.defaults = plan.defaults
+        self.id_position = plan.id_position
+        self.id_index = id_index
+        self.commit_rows = commit_rows
+        self.commit_seconds = commit_seconds
+        # Rows written since the last commit, kept to replay them if the commit fails
+        self.uncommitted = []
+        # Ids inserted since the last commit, added to id_index once committed
+        self.inserted_ids = []
+        self.last_commit = time.monotonic()
+        self.rows_committed = 0
+        self.rows_failed = 0
+        # Checkpointing, set by the loader when the progress journal is enabled
+        self.mapping_key = None
+        self.checkpoint_journal = None
+        # Id of the last source row handled, committed or failed
+        self.last_seen_id = None
+        # MappingMetrics of the mapping, set by the loader
+        self.metrics = None
+        # Quarantine of the failed rows, set by the loader. Entries and replayed ids are
+        # written with the next successful commit, so they survive a failed one
+        self.quarantine = None
+        self.quarantine_key = None
+        self.old_table = None
+        self.failure_log = None
+        self.quarantined = []
+        # Source ids handled since the last commit when replaying the quarantine, None otherwise
+        self.replayed_ids = None
+        # StagingTable the rows are loaded into in merge mode
+        self.staging_table = None
+        # ChangeTracker of the mapping, rows whose content did not change are not written
+        self.change_tracker = None
+        self.rows_unchanged = 0
+
+    def commit_due(self) -> bool:
+        """
+        Tells whether the open transaction reached the row or time limit of the commit policy.
+        """
+        if not self.uncommitted:
+            return False
+        return (len(self.uncommitted) >= self.commit_rows
+                or time.monotonic() - self.last_commit >= self.commit_seconds)
+
+    def reset_transaction(self):
+        self.uncommitted = []
+        self.inserted_ids = []
+        self.last_commit = time.monotonic()
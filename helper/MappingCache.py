@@ -0,0 +1,65 @@
+import hashlib
+import json
+import os
+
+
+class MappingCache:
+    """
+    Compiled form of the mapping XML files, stored as one JSON file.
+    Each entry is keyed by the path of its source file and remembers the file's
+    mtime, size and sha256: an unchanged mtime and size reuse the entry directly, a
+    changed one is only recompiled when the content hash differs as well.
+    """
+
+    # Raised whenever the compiled format changes, older caches are then ignored
+    VERSION = 3
+
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(cache_path, 'r') as file:
+                cache = json.load(file)
+            if cache.get('version') == self.VERSION:
+                self.entries = cache['entries']
+        except (OSError, ValueError, KeyError):
+            # Missing or unreadable cache, everything is compiled again
+            self.entries = {}
+
+    def get(self, file_path: str, compile_function):
+        """
+        Returns the compiled content of a source file, compiling it when needed.
+        Args:
+            file_path: Path of the source file.
+            compile_function: Called with file_path, returns the JSON serializable compiled content.
+        Returns:
+            The compiled content.
+        """
+        key = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        entry = self.entries.get(key)
+        if entry is not None and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return entry['data']
+        with open(file_path, 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        if entry is None or entry['sha256'] != digest:
+            entry = {'sha256': digest, 'data': compile_function(file_path)}
+        entry['mtime'] = stat.st_mtime_ns
+        entry['size'] = stat.st_size
+        self.entries[key] = entry
+        self.dirty = True
+        return entry['data']
+
+    def save(self):
+        """
+        Writes the cache when entries changed. The file is replaced atomically,
+        so a concurrent reader sees either the old or the new cache.
+        """
+        if not self.dirty:
+            return
+        temporary_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump({'version': self.VERSION, 'entries': self.entries}, file, separators=(',', ':'))
+        os.replace(temporary_path, self.cache_path)
+        self.dirty = False
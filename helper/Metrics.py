@@ -0,0 +1,240 @@
+import json
+import os
+import time
+
+
+class TimedFunction:
+    """
+    Wraps a processing function or DataTypeHandler converter and accumulates
+    its number of calls and the time spent in it. Picklable as long as the
+    wrapped function is, so it also works in the transform worker processes.
+    """
+
+    def __init__(self, name: str, function):
+        self.name = name
+        self.function = function
+        self.__name__ = function.__name__
+        self.calls = 0
+        self.seconds = 0.0
+
+    def __call__(self, *args):
+        started = time.perf_counter()
+        try:
+            return self.function(*args)
+        finally:
+            self.calls += 1
+            self.seconds += time.perf_counter() - started
+
+    def take(self) -> tuple:
+        """
+        Returns (calls, seconds) accumulated since the last call and resets them.
+        """
+        calls, seconds = self.calls, self.seconds
+        self.calls = 0
+        self.seconds = 0.0
+        return calls, seconds
+
+
+class MappingMetrics:
+    """
+    Throughput and time per stage of one mapping. Byte counts are estimated from
+    the text size of the first row of every batch, which is cheap and close
+    enough to compare tables and runs.
+    """
+
+    STAGES = ('extract', 'transform', 'load', 'commit')
+    # Upper bounds, in seconds, of the commit latency histogram buckets
+    COMMIT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, mapping_key: str, old_table: str, new_table: str):
+        self.mapping_key = mapping_key
+        self.old_table = old_table
+        self.new_table = new_table
+        self.started_at = time.time()
+        self.elapsed = 0.0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        # Cumulative counts per bucket, the last one is +Inf
+        self.commit_buckets = [0] * (len(self.COMMIT_BUCKETS) + 1)
+        self.commit_count = 0
+        self.commit_sum = 0.0
+        # {function name: [calls, seconds]}
+        self.functions = {}
+        self.pipeline = None
+        self.partitions = 0
+        self.extra = {}
+
+    @staticmethod
+    def estimate_bytes(rows) -> int:
+        if not rows:
+            return 0
+        return sum(len(str(value)) for value in rows[0] if value is not None) * len(rows)
+
+    def timed_batches(self, batches):
+        """
+        Yields the batches of an iterable, counting their rows and the time spent fetching them.
+        """
+        batch_iterator = iter(batches)
+        while True:
+            started = time.perf_counter()
+            rows = next(batch_iterator, None)
+            self.seconds['extract'] += time.perf_counter() - started
+            if rows is None:
+                return
+            self.rows_read += len(rows)
+            self.bytes_read += self.estimate_bytes(rows)
+            yield rows
+
+    def add_functions(self, timings: dict):
+        for name, (calls, seconds) in timings.items():
+            totals = self.functions.setdefault(name, [0, 0.0])
+            totals[0] += calls
+            totals[1] += seconds
+
+    def observe_commit(self, seconds: float):
+        self.seconds['commit'] += seconds
+        self.commit_count += 1
+        self.commit_sum += seconds
+        for index, bound in enumerate(self.COMMIT_BUCKETS):
+            if seconds <= bound:
+                self.commit_buckets[index] += 1
+        self.commit_buckets[-1] += 1
+
+    def merge(self, other):
+        """
+        Adds the counters of a partition of the same mapping.
+        """
+        self.partitions += 1
+        self.rows_read += other.rows_read
+        self.rows_written += other.rows_written
+        self.rows_failed += other.rows_failed
+        self.bytes_read += other.bytes_read
+        self.bytes_written += other.bytes_written
+        for stage in self.STAGES:
+            self.seconds[stage] += other.seconds[stage]
+        self.commit_buckets = [mine + theirs for mine, theirs in zip(self.commit_buckets, other.commit_buckets)]
+        self.commit_count += other.commit_count
+        self.commit_sum += other.commit_sum
+        self.add_functions(other.functions)
+        if 'errors' in other.extra:
+            errors = self.extra.setdefault('errors', {})
+            for error_class, count in other.extra['errors'].items():
+                errors[error_class] = errors.get(error_class, 0) + count
+        if 'profile' in other.extra:
+            self.extra.setdefault('partition_profiles', []).append(other.extra['profile'])
+
+    def finish(self):
+        self.elapsed = time.time() - self.started_at
+
+    def as_dict(self) -> dict:
+        elapsed = self.elapsed or 1e-9
+        return {
+            'mapping_key': self.mapping_key,
+            'old_table': self.old_table,
+            'new_table': self.new_table,
+            'elapsed': round(self.elapsed, 3),
+            'rows_read': self.rows_read,
+            'rows_written': self.rows_written,
+            'rows_failed': self.rows_failed,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'rows_per_second': round(self.rows_written / elapsed, 1),
+            'bytes_per_second': round(self.bytes_written / elapsed, 1),
+            'seconds': {stage: round(seconds, 3) for stage, seconds in self.seconds.items()},
+            'commit_latency': {
+                'buckets': {str(bound): count for bound, count in zip(self.COMMIT_BUCKETS + ('+Inf',),
+                                                                      self.commit_buckets)},
+                'count': self.commit_count,
+                'sum': round(self.commit_sum, 3),
+            },
+            'functions': {name: {'calls': calls, 'seconds': round(seconds, 3)}
+                          for name, (calls, seconds) in sorted(self.functions.items(), key=lambda item: -item[1][1])},
+            'partitions': self.partitions,
+            'pipeline': self.pipeline,
+            **self.extra,
+        }
+
+
+class RunReport:
+    """
+    Metrics of all mappings of a run, written as a JSON report and optionally
+    as a Prometheus textfile (for the node_exporter textfile collector).
+    """
+
+    PROMETHEUS_PREFIX = 'odoo_migration'
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.mappings = []
+
+    def add(self, mapping_metrics):
+        for metrics in mapping_metrics:
+            if metrics is not None:
+                self.mappings.append(metrics)
+
+    def as_dict(self) -> dict:
+        mappings = [metrics.as_dict() for metrics in self.mappings]
+        elapsed = time.time() - self.started_at
+        rows_written = sum(mapping['rows_written'] for mapping in mappings)
+        return {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+            'elapsed': round(elapsed, 3),
+            'rows_read': sum(mapping['rows_read'] for mapping in mappings),
+            'rows_written': rows_written,
+            'rows_failed': sum(mapping['rows_failed'] for mapping in mappings),
+            'rows_per_second': round(rows_written / elapsed, 1) if elapsed else 0,
+            'mappings': mappings,
+        }
+
+    def write(self, path: str):
+        self.write_atomically(path, json.dumps(self.as_dict(), indent=2))
+
+    def write_prometheus(self, path: str):
+        """
+        Writes the metrics in the Prometheus text format, each metric family as one group.
+        """
+        prefix = self.PROMETHEUS_PREFIX
+        families = {
+            'rows_total': ('counter', []),
+            'bytes_total': ('counter', []),
+            'stage_seconds_total': ('counter', []),
+            'commit_seconds': ('histogram', []),
+            'function_seconds_total': ('counter', []),
+            'function_calls_total': ('counter', []),
+        }
+        for metrics in self.mappings:
+            labels = f'mapping="{metrics.mapping_key}",table="{metrics.new_table}"'
+            for state, count in (('read', metrics.rows_read), ('written', metrics.rows_written),
+                                 ('failed', metrics.rows_failed)):
+                families['rows_total'][1].append(f'{prefix}_rows_total{{{labels},state="{state}"}} {count}')
+            for direction, count in (('read', metrics.bytes_read), ('written', metrics.bytes_written)):
+                families['bytes_total'][1].append(f'{prefix}_bytes_total{{{labels},direction="{direction}"}} {count}')
+            for stage, seconds in metrics.seconds.items():
+                families['stage_seconds_total'][1].append(
+                    f'{prefix}_stage_seconds_total{{{labels},stage="{stage}"}} {seconds:.6f}')
+            histogram = families['commit_seconds'][1]
+            for bound, count in zip(metrics.COMMIT_BUCKETS + ('+Inf',), metrics.commit_buckets):
+                histogram.append(f'{prefix}_commit_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            histogram.append(f'{prefix}_commit_seconds_sum{{{labels}}} {metrics.commit_sum:.6f}')
+            histogram.append(f'{prefix}_commit_seconds_count{{{labels}}} {metrics.commit_count}')
+            for name, (calls, seconds) in metrics.functions.items():
+                families['function_seconds_total'][1].append(
+                    f'{prefix}_function_seconds_total{{{labels},function="{name}"}} {seconds:.6f}')
+                families['function_calls_total'][1].append(
+                    f'{prefix}_function_calls_total{{{labels},function="{name}"}} {calls}')
+        lines = []
+        for family, (metric_type, samples) in families.items():
+            lines.append(f"# TYPE {prefix}_{family} {metric_type}")
+            lines.extend(samples)
+        self.write_atomically(path, '\n'.join(lines) + '\n')
+
+    @staticmethod
+    def write_atomically(path: str, content: str):
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w') as file:
+            file.write(content)
+        os.replace(temporary_path, path)
@@ -0,0 +1,235 @@
+import json
+import logging
+import time
+
+import psycopg2
+
+
+class ParityCheck:
+    """
+    Compares the rows of a mapping in the old and new databases without moving them.
+    Both sides hash every row inside the database, md5 of the mapped columns
+    converted like the loader does, and aggregate the hashes per id chunk
+    (md5 of the ordered string_agg); only chunks whose hashes differ are compared
+    row by row, and only a sample of the differing rows is read column by column.
+    """
+
+    # SQL counterparts of the DataTypeHandler converters, {column} is the old column.
+    # The loader does not convert None, so NULL stays NULL
+    CONVERSIONS = {
+        'adapt_datetime_to_datetime': "{column}::timestamp",
+        'adapt_boolean_to_char': "CASE WHEN {column} THEN 'True' WHEN NOT {column} THEN 'False' END",
+        'adapt_boolean_to_text': "CASE WHEN {column} IS NULL THEN NULL WHEN {column} THEN 'True' ELSE 'False' END",
+        'adapt_integer_to_integer': "{column}::bigint",
+        'adapt_float_to_integer': "trunc({column})::bigint",
+        'adapt_selection_to_char': "{column}",
+    }
+
+    def __init__(self, old_schema, new_schema, chunk_size: int = 10000, sample: int = 10):
+        """
+        Args:
+            old_schema: SchemaCatalog of the old database.
+            new_schema: SchemaCatalog of the new database.
+            chunk_size: Number of consecutive ids hashed together.
+            sample: Differing rows per mapping whose columns are compared.
+        """
+        self.old_schema = old_schema
+        self.new_schema = new_schema
+        self.chunk_size = chunk_size
+        self.sample = sample
+
+    def column_expressions(self, old_table: str, new_table: str, field_mappings: list, functions: dict,
+                           defaults: dict = None) -> tuple:
+        """
+        Builds the comparable text expression of every verifiable column on both sides.
+        Columns set by processing functions, or converted by a converter without SQL
+        counterpart, can only be computed in Python and are left out. Mapped columns
+        that also have a default are left out too: inserted records get the default,
+        updated ones the mapped value.
+        Returns:
+            Tuple of the list of (new column, old expression, new expression) and the list of skipped new columns.
+        """
+        columns = []
+        skipped = []
+        for field in field_mappings:
+            old_column = field['field_name_old']
+            new_column = field['field_name_new']
+            if new_column in functions or new_column in (defaults or {}):
+                skipped.append(new_column)
+                continue
+            # SQL transformations of the mapping are applied like in the loader's SELECT
+            old_expression = field.get('expression', old_column)
+            old_field_type = field.get('field_type_old')
+            new_field_type = field.get('field_type_new')
+            if old_field_type and new_field_type and old_field_type != new_field_type:
+                conversion = self.CONVERSIONS.get(f"adapt_{old_field_type.lower()}_to_{new_field_type.lower()}")
+                if conversion is None:
+                    skipped.append(new_column)
+                    continue
+                old_expression = conversion.format(column=f"({old_expression})")
+            old_type = self.old_schema.column_type(old_table, old_column)
+            new_type = self.new_schema.column_type(new_table, new_column)
+            if new_type and (old_type != new_type or old_expression != old_column):
+                # Stored through the new column type, so both sides print values the same way
+                old_expression = f"({old_expression})::{new_type}"
+            columns.append((new_column, f"({old_expression})::text", f"{new_column}::text"))
+        return columns, skipped
+
+    @staticmethod
+    def row_hash(expressions: list) -> str:
+        # ROW(...)::text quotes the values, so NULL, '' and separators inside values hash differently
+        return f"md5(ROW({', '.join(expressions)})::text)"
+
+    def chunk_hashes(self, conn, table: str, id_column: str, expressions: list, conditions: list, params: list) -> dict:
+        """
+        Returns {chunk number: (rows, hash)} of a table, computed in one query.
+        """
+        query = (f"SELECT {id_column} / %s, count(*), md5(string_agg({self.row_hash(expressions)}, '' "
+                 f"ORDER BY {id_column})) FROM {table}")
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' GROUP BY 1'
+        with conn.cursor() as cursor:
+            cursor.execute(query, [self.chunk_size] + list(params))
+            chunks = {chunk: (rows, digest) for chunk, rows, digest in cursor.fetchall()}
+        conn.rollback()
+        return chunks
+
+    def row_hashes(self, conn, table: str, id_column: str, expressions: list, chunk: int) -> dict:
+        """
+        Returns {id: hash} of the rows of one chunk.
+        """
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT {id_column}, {self.row_hash(expressions)} FROM {table} "
+                           f"WHERE {id_column} >= %s AND {id_column} < %s",
+                           (chunk * self.chunk_size, (chunk + 1) * self.chunk_size))
+            hashes = dict(cursor.fetchall())
+        conn.rollback()
+        return hashes
+
+    def row_values(self, conn, table: str, id_column: str, expressions: list, ids: list) -> dict:
+        """
+        Returns {id: tuple of column texts} of the given rows.
+        """
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT {id_column}, {', '.join(expressions)} FROM {table} WHERE {id_column} = ANY(%s)",
+                           (ids,))
+            values = {row[0]: row[1:] for row in cursor.fetchall()}
+        conn.rollback()
+        return values
+
+    def verify(self, old_conn, new_conn, mapping_key: str, old_table: str, new_table: str, field_mappings: list,
+               functions: dict, start_id=None, defaults: dict = None) -> dict:
+        """
+        Verifies one mapping.
+        Args:
+            old_conn: Connection to the old database.
+            new_conn: Connection to the new database.
+            mapping_key: Key of the mapping, used in the result.
+            old_table: Name of the old table.
+            new_table: Name of the new table.
+            field_mappings: Field mappings that exist in both schemas.
+            functions: Processing function name per new field name.
+            start_id: Optional <start_id> of the mapping, rows with a lower id are not compared.
+            defaults: Default values of the mapping, mapped columns that have one are not compared.
+        Returns:
+            Dictionary with the compared and skipped columns, the chunk counts and the differing rows.
+        """
+        started = time.perf_counter()
+        old_id = next((field['field_name_old'] for field in field_mappings if field['field_name_new'] == 'id'), 'id')
+        columns, skipped = self.column_expressions(old_table, new_table, field_mappings, functions, defaults)
+        columns = [column for column in columns if column[0] != 'id']
+        old_expressions = [old_expression for _, old_expression, _ in columns]
+        new_expressions = [new_expression for _, _, new_expression in columns]
+        result = {
+            'mapping_key': mapping_key,
+            'old_table': old_table,
+            'new_table': new_table,
+            'columns': [new_column for new_column, _, _ in columns],
+            'skipped_columns': skipped,
+        }
+        old_conditions, new_conditions, params = [], [], []
+        if start_id:
+            old_conditions.append(f"{old_id} >= %s")
+            new_conditions.append("id >= %s")
+            params.append(start_id)
+        old_chunks = self.chunk_hashes(old_conn, old_table, old_id, old_expressions, old_conditions, params)
+        new_chunks = self.chunk_hashes(new_conn, new_table, 'id', new_expressions, new_conditions, params)
+        differing_chunks = sorted(chunk for chunk in old_chunks.keys() | new_chunks.keys()
+                                  if old_chunks.get(chunk) != new_chunks.get(chunk))
+        missing, extra, different = [], [], []
+        for chunk in differing_chunks:
+            old_hashes = self.row_hashes(old_conn, old_table, old_id, old_expressions, chunk)
+            new_hashes = self.row_hashes(new_conn, new_table, 'id', new_expressions, chunk)
+            if start_id:
+                old_hashes = {key: value for key, value in old_hashes.items() if key >= start_id}
+                new_hashes = {key: value for key, value in new_hashes.items() if key >= start_id}
+            missing += sorted(old_hashes.keys() - new_hashes.keys())
+            extra += sorted(new_hashes.keys() - old_hashes.keys())
+            different += sorted(key for key in old_hashes.keys() & new_hashes.keys()
+                                if old_hashes[key] != new_hashes[key])
+        samples = []
+        if different and self.sample:
+            sample_ids = different[:self.sample]
+            old_values = self.row_values(old_conn, old_table, old_id, old_expressions, sample_ids)
+            new_values = self.row_values(new_conn, new_table, 'id', new_expressions, sample_ids)
+            for record_id in sample_ids:
+                samples.append({
+                    'id': record_id,
+                    'columns': {new_column: {'old': old_value, 'new': new_value}
+                                for (new_column, _, _), old_value, new_value
+                                in zip(columns, old_values[record_id], new_values[record_id])
+                                if old_value != new_value},
+                })
+        result.update({
+            'chunks': len(old_chunks.keys() | new_chunks.keys()),
+            'differing_chunks': len(differing_chunks),
+            'old_rows': sum(rows for rows, _ in old_chunks.values()),
+            'new_rows': sum(rows for rows, _ in new_chunks.values()),
+            'missing_rows': len(missing),
+            'extra_rows': len(extra),
+            'different_rows': len(different),
+            'missing_ids': missing[:self.sample],
+            'extra_ids': extra[:self.sample],
+            'different_ids': different[:self.sample],
+            'samples': samples,
+            'elapsed': round(time.perf_counter() - started, 3),
+        })
+        result['status'] = 'ok' if not (missing or extra or different) else 'different'
+        return result
+
+    def verify_safely(self, old_conn, new_conn, *args, **kwargs) -> dict:
+        """
+        Calls verify, reporting SQL errors (e.g. an impossible cast) as the result of the mapping.
+        """
+        try:
+            return self.verify(old_conn, new_conn, *args, **kwargs)
+        except psycopg2.Error as e:
+            old_conn.rollback()
+            new_conn.rollback()
+            return {'mapping_key': args[0], 'status': 'error', 'error': str(e).strip()}
+
+    @staticmethod
+    def log_result(result: dict):
+        if result['status'] == 'error':
+            logging.error(f"Could not verify {result['mapping_key']}: {result['error']}")
+            return
+        message = (f"{result['mapping_key']} ({result['old_table']} -> {result['new_table']}): "
+                   f"{result['old_rows']} old rows, {result['new_rows']} new rows, "
+                   f"{result['differing_chunks']} of {result['chunks']} chunks differ, "
+                   f"{result['missing_rows']} missing, {result['extra_rows']} extra, "
+                   f"{result['different_rows']} different in {result['elapsed']}s")
+        if result['skipped_columns']:
+            message += f"; not compared: {', '.join(result['skipped_columns'])}"
+        if result['status'] == 'ok':
+            logging.info(message)
+        else:
+            logging.warning(message)
+
+    @staticmethod
+    def write(results: list, path: str):
+        with open(path, 'w') as file:
+            json.dump({
+                'verified_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'mappings': results,
+            }, file, indent=2, default=str)
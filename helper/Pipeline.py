@@ -0,0 +1,170 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# RowPlan of the mapping, installed once in every transform worker process
+_worker_plan = None
+
+
+def _init_transform_worker(plan):
+    global _worker_plan
+    _worker_plan = plan
+
+
+def _transform_batch(rows, plan=None):
+    plan = plan or _worker_plan
+    started = time.perf_counter()
+    records, failures = plan.transform_batch(rows)
+    return records, failures, time.perf_counter() - started, plan.take_timings()
+
+
+class PipelineStats:
+    """
+    Where the time of a pipelined mapping went. A stage is idle while it waits
+    for its input or for room in the queue after it; the busiest stage with
+    the least idle time is the bottleneck.
+    """
+
+    STAGES = ('read', 'transform', 'write')
+
+    def __init__(self, transform_workers: int, queue_size: int):
+        self.transform_workers = transform_workers
+        self.queue_size = queue_size
+        self.busy = dict.fromkeys(self.STAGES, 0.0)
+        self.idle = dict.fromkeys(self.STAGES, 0.0)
+        self.batches = 0
+        self.depth_total = 0
+        self.depth_max = 0
+        self.elapsed = 0.0
+        # {function name: [calls, seconds]} of the timed converters and processing functions
+        self.functions = {}
+
+    def sample_depth(self, depth: int):
+        self.batches += 1
+        self.depth_total += depth
+        self.depth_max = max(self.depth_max, depth)
+
+    def as_dict(self) -> dict:
+        return {
+            'elapsed': round(self.elapsed, 3),
+            'batches': self.batches,
+            'busy': {stage: round(seconds, 3) for stage, seconds in self.busy.items()},
+            'idle': {stage: round(seconds, 3) for stage, seconds in self.idle.items()},
+            'queue_size': self.queue_size,
+            'queue_depth_avg': round(self.depth_total / self.batches, 2) if self.batches else 0,
+            'queue_depth_max': self.depth_max,
+        }
+
+    def summary(self) -> str:
+        stages = ', '.join(f"{stage} busy {self.busy[stage]:.1f}s idle {self.idle[stage]:.1f}s" for stage in self.STAGES)
+        average_depth = self.depth_total / self.batches if self.batches else 0
+        return (f"{self.batches} batches in {self.elapsed:.1f}s, {stages}, "
+                f"queue depth avg {average_depth:.1f} max {self.depth_max} of {self.queue_size}")
+
+
+class Pipeline:
+    """
+    Runs the read, transform and write stages of a mapping at the same time.
+    A reader thread fetches batches from the old database and hands them to a
+    pool of transform processes; the transformed batches wait in a bounded queue
+    and are written by the calling thread in their original order. A full queue
+    blocks the reader, so memory stays bounded when the writer is the slowest stage.
+    """
+
+    _END = object()
+
+    def __init__(self, plan, transform_workers: int = 2, queue_size: int = 8):
+        """
+        Args:
+            plan: RowPlan of the mapping.
+            transform_workers: Number of transform processes, 0 to transform in the reader thread.
+            queue_size: Maximum number of batches read but not yet written.
+        """
+        self.plan = plan
+        self.transform_workers = transform_workers
+        self.queue_size = queue_size
+
+    def run(self, batches, write_batch) -> PipelineStats:
+        """
+        Processes all batches.
+        Args:
+            batches: Iterable of lists of rows, consumed by the reader thread.
+            write_batch: Called with (rows, records, failures) for every batch, in order,
+                from the calling thread.
+        Returns:
+            PipelineStats of the run.
+        """
+        stats = PipelineStats(self.transform_workers, self.queue_size)
+        load_queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        reader_errors = []
+        executor = None
+        if self.transform_workers > 0:
+            executor = ProcessPoolExecutor(max_workers=self.transform_workers, initializer=_init_transform_worker,
+                                           initargs=(self.plan,))
+
+        def read():
+            try:
+                batch_iterator = iter(batches)
+                while not stop.is_set():
+                    started = time.perf_counter()
+                    rows = next(batch_iterator, None)
+                    stats.busy['read'] += time.perf_counter() - started
+                    if rows is None:
+                        break
+                    if executor is not None:
+                        future = executor.submit(_transform_batch, rows)
+                    else:
+                        future = Future()
+                        future.set_result(_transform_batch(rows, self.plan))
+                    started = time.perf_counter()
+                    load_queue.put((rows, future))
+                    stats.idle['read'] += time.perf_counter() - started
+            except BaseException as e:
+                reader_errors.append(e)
+            finally:
+                load_queue.put(self._END)
+
+        started = time.perf_counter()
+        reader = threading.Thread(target=read, name='pipeline-reader', daemon=True)
+        reader.start()
+        try:
+            while True:
+                waited = time.perf_counter()
+                item = load_queue.get()
+                if item is self._END:
+                    stats.idle['write'] += time.perf_counter() - waited
+                    break
+                stats.sample_depth(load_queue.qsize() + 1)
+                rows, future = item
+                records, failures, transform_seconds, timings = future.result()
+                stats.idle['write'] += time.perf_counter() - waited
+                stats.busy['transform'] += transform_seconds
+                for name, (calls, seconds) in timings.items():
+                    totals = stats.functions.setdefault(name, [0, 0.0])
+                    totals[0] += calls
+                    totals[1] += seconds
+                writing = time.perf_counter()
+                write_batch(rows, records, failures)
+                stats.busy['write'] += time.perf_counter() - writing
+        except BaseException:
+            # Unblock the reader, it may be waiting for room in the queue
+            stop.set()
+            while reader.is_alive() or not load_queue.empty():
+                try:
+                    if load_queue.get(timeout=0.1) is self._END:
+                        break
+                except queue.Empty:
+                    pass
+            raise
+        finally:
+            reader.join()
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            stats.elapsed = time.perf_counter() - started
+            transform_capacity = stats.elapsed * max(self.transform_workers, 1)
+            stats.idle['transform'] = max(transform_capacity - stats.busy['transform'], 0.0)
+        if reader_errors:
+            raise reader_errors[0]
+        return stats
@@ -0,0 +1,132 @@
+import cProfile
+import os
+import pstats
+import re
+import sys
+import threading
+from collections import Counter, defaultdict
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler looking at the stacks of all other threads of the process
+    every `interval` seconds. Its overhead does not depend on the number of calls,
+    and its results are exposed like cProfile's, so they load in pstats and the
+    usual .prof viewers; times are estimates (samples x interval).
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.self_samples = Counter()
+        self.total_samples = Counter()
+        self.caller_samples = defaultdict(Counter)
+        self.stats = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sample_loop(self):
+        own_thread = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread:
+                    self._sample(frame)
+
+    def _sample(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        self.self_samples[stack[0]] += 1
+        for function in set(stack):  # Recursive functions are counted once per sample
+            self.total_samples[function] += 1
+        for function, caller in zip(stack, stack[1:]):
+            self.caller_samples[function][caller] += 1
+
+    def create_stats(self):
+        """
+        Converts the samples to the pstats layout: {function: (calls, calls, self time, total time, callers)}.
+        """
+        interval = self.interval
+        self.stats = {
+            function: (samples, samples, self.self_samples[function] * interval, samples * interval,
+                       {caller: (count, count, 0.0, count * interval)
+                        for caller, count in self.caller_samples[function].items()})
+            for function, samples in self.total_samples.items()
+        }
+
+
+class MappingProfiler:
+    """
+    Profiles the processing of each mapping, writes one .prof file per mapping
+    and summarizes the hottest functions, with the processing.* functions of the
+    mapping listed on their own.
+    """
+
+    MODES = ('cprofile', 'sampling')
+
+    def __init__(self, mode: str = 'cprofile', directory: str = 'profiles', top: int = 20,
+                 interval: float = 0.005):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown profiler: {mode}")
+        self.mode = mode
+        self.directory = directory
+        self.top = top
+        self.interval = interval
+        self.processing_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                 'processing') + os.sep
+
+    def run(self, name: str, function, *args, **kwargs):
+        """
+        Calls function(*args, **kwargs) under the profiler.
+        Args:
+            name: Name of the profiled mapping, used for the .prof file.
+        Returns:
+            Tuple of the result of the function and the profile summary.
+        """
+        profiler = cProfile.Profile() if self.mode == 'cprofile' else SamplingProfiler(self.interval)
+        profiler.enable()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            profiler.disable()
+            summary = self.save(name, profiler)
+        return result, summary
+
+    def save(self, name: str, profiler) -> dict:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, re.sub(r'[^A-Za-z0-9._-]+', '_', name) + '.prof')
+        stats = pstats.Stats(profiler)
+        stats.dump_stats(path)
+        return {
+            'profiler': self.mode,
+            'file': path,
+            'top': self.summarize(stats, key=lambda entry: entry[2]),
+            'processing': self.summarize(stats, key=lambda entry: entry[3],
+                                         select=lambda function: function[0].startswith(self.processing_directory)),
+        }
+
+    def summarize(self, stats, key, select=None) -> list:
+        """
+        Returns the top functions of the stats, ordered by `key` applied to their pstats values.
+        """
+        entries = [(function, values) for function, values in stats.stats.items()
+                   if select is None or select(function)]
+        entries.sort(key=lambda item: key(item[1]), reverse=True)
+        return [{
+            'function': f"{os.path.relpath(filename) if filename.startswith(os.sep) else filename}:{line}({name})",
+            'calls': values[1],
+            'self_seconds': round(values[2], 4),
+            'cumulative_seconds': round(values[3], 4),
+        } for (filename, line, name), values in entries[:self.top]]
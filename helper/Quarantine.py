@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import time
+
+from psycopg2.extras import execute_values
+
+
+class Quarantine:
+    """
+    Rows that could not be migrated, with their mapping, source id, error class and message.
+    They are kept in a side table of the new database, written in the same transaction
+    as the batch they belong to, or appended to a JSONL file after that transaction
+    is committed. The replay mode reads the quarantined ids back to migrate only those rows.
+    """
+
+    TABLE = 'migration_quarantine'
+    COLUMNS = ('mapping_key', 'source_table', 'target_table', 'record_id', 'stage', 'error_class', 'message',
+               'row_data', 'detail')
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path: JSONL file receiving the failed rows, None to use the quarantine table.
+        """
+        self.path = path
+
+    @staticmethod
+    def entry(mapping_key: str, source_table: str, target_table: str, record_id, stage: str, error_class: str,
+              message: str, row=None, detail=None) -> dict:
+        return {
+            'mapping_key': mapping_key,
+            'source_table': source_table,
+            'target_table': target_table,
+            'record_id': record_id,
+            'stage': stage,
+            'error_class': error_class,
+            'message': message,
+            'row_data': json.dumps(list(row), default=str) if row is not None else None,
+            'detail': detail,
+        }
+
+    def ensure_table(self, conn):
+        if self.path is not None:
+            return
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                    id bigserial PRIMARY KEY,
+                    mapping_key varchar NOT NULL,
+                    source_table varchar,
+                    target_table varchar,
+                    record_id bigint,
+                    stage varchar,
+                    error_class varchar,
+                    message text,
+                    row_data text,
+                    detail text,
+                    recorded_at timestamp NOT NULL DEFAULT now()
+                )
+            """)
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {self.TABLE}_mapping_key_index "
+                           f"ON {self.TABLE} (mapping_key, record_id)")
+        conn.commit()
+
+    def write_pending(self, cursor, entries: list):
+        """
+        Writes entries to the quarantine table inside the open transaction. Does nothing in file mode.
+        """
+        if self.path is None and entries:
+            execute_values(cursor, f"INSERT INTO {self.TABLE} ({', '.join(self.COLUMNS)}) VALUES %s",
+                           [[entry[column] for column in self.COLUMNS] for entry in entries])
+
+    def write_committed(self, entries: list, mapping_key: str = None, replayed_ids: list = None):
+        """
+        Appends entries to the JSONL file once their transaction is committed. Does nothing in table mode.
+        Replayed ids are appended first as markers, dropping the earlier entries of these rows
+        like `forget` does in the table; rows failing again keep the entries written after them.
+        """
+        if self.path is None:
+            return
+        lines = [json.dumps({'mapping_key': mapping_key, 'record_id': record_id, 'replayed': True}) + '\n'
+                 for record_id in replayed_ids or []]
+        lines += [json.dumps(entry) + '\n' for entry in entries]
+        if lines:
+            # One write per batch, so processes appending to the same file do not interleave lines
+            with open(self.path, 'a') as file:
+                file.write(''.join(lines))
+
+    def forget(self, cursor, mapping_key: str, record_ids: list):
+        """
+        Removes the entries of replayed rows inside the open transaction, so they are only
+        gone once the replay is committed; rows failing again get new entries.
+        In file mode the rows are marked as replayed by write_committed instead.
+        """
+        if self.path is None and record_ids:
+            cursor.execute(f"DELETE FROM {self.TABLE} WHERE mapping_key = %s AND record_id = ANY(%s)",
+                           (mapping_key, record_ids))
+
+    def read_entries(self) -> list:
+        """
+        Returns the entries of the JSONL file still quarantined: the entries a later
+        replay marker covers are left out.
+        """
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        # Number of entries read before the last replay marker of each row
+        replayed = {}
+        with open(self.path) as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get('replayed'):
+                    replayed[(entry['mapping_key'], entry['record_id'])] = len(entries)
+                else:
+                    entries.append(entry)
+        return [entry for position, entry in enumerate(entries)
+                if position >= replayed.get((entry['mapping_key'], entry['record_id']), 0)]
+
+    def start_replay(self, conn) -> dict:
+        """
+        Reads the quarantined ids to replay. In file mode the file stays in place: replayed
+        rows are marked in it as their batches are committed, and finish_replay rewrites it.
+        Returns:
+            Dictionary of mapping key to the sorted list of quarantined source ids.
+        """
+        record_ids = {}
+        if self.path is None:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT DISTINCT mapping_key, record_id FROM {self.TABLE} WHERE record_id IS NOT NULL")
+                for mapping_key, record_id in cursor.fetchall():
+                    record_ids.setdefault(mapping_key, []).append(record_id)
+            conn.commit()
+        else:
+            for entry in self.read_entries():
+                if entry['record_id'] is not None:
+                    record_ids.setdefault(entry['mapping_key'], []).append(entry['record_id'])
+        return {mapping_key: sorted(set(ids)) for mapping_key, ids in record_ids.items()}
+
+    def finish_replay(self):
+        """
+        Rewrites the JSONL file with the entries still quarantined after a replay: rows that
+        were not replayed (skipped mapping, crash) and rows that failed again. Does nothing in table mode.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return
+        entries = self.read_entries()
+        if not entries:
+            os.remove(self.path)
+            return
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            file.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        os.replace(temporary_path, self.path)
+
+
+class FailureLog:
+    """
+    Rate-limited logging of failed rows. The first failure of every error class is
+    logged with its message; later ones are only counted and summarized at most
+    once per interval, and once more when the mapping ends.
+    """
+
+    def __init__(self, table: str, interval: float = 30.0):
+        self.table = table
+        self.interval = interval
+        self.counts = {}
+        self.totals = {}
+        self.last_report = time.monotonic()
+
+    def report(self, error_class: str, message: str, record_id):
+        if error_class not in self.totals:
+            logging.warning(f"{error_class} migrating row {record_id} to {self.table}: {message} "
+                            f"(further {error_class} errors are summarized)")
+        self.totals[error_class] = self.totals.get(error_class, 0) + 1
+        self.counts[error_class] = self.counts.get(error_class, 0) + 1
+        if time.monotonic() - self.last_report >= self.interval:
+            self.summarize()
+
+    def summarize(self):
+        if self.counts:
+            errors = ', '.join(f"{count} {error_class}" for error_class, count in
+                               sorted(self.counts.items(), key=lambda item: -item[1]))
+            logging.warning(f"Rows of {self.table} failed since the last report: {errors}")
+        self.counts = {}
+        self.last_report = time.monotonic()
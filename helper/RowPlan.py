@@ -0,0 +1,246 @@
+import logging
+import traceback
+
+from helper.Metrics import TimedFunction
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, columnar casts then use plain list comprehensions
+    np = None
+
+
+class RowPlan:
+    """
+    Transformation plan of one mapping, compiled once before its rows are processed.
+    Column positions, DataTypeHandler converters, processing functions and the
+    column order of inserted records are resolved up front, so transforming a
+    row only runs the prepared steps.
+    """
+
+    # Converters NumPy can apply to a whole column with the same result as int()
+    NUMPY_INTEGER_CASTS = ('adapt_float_to_integer', 'adapt_integer_to_integer')
+    # Floats up to 2**53 are exact integers, so truncating them through NumPy is lossless
+    NUMPY_EXACT_LIMIT = 2 ** 53
+    # Values converted before deciding whether a column has few enough distinct values to memoize
+    MEMO_SAMPLE = 1000
+
+    def __init__(self, new_table: str, field_mappings: list, defaults: dict, functions: dict,
+                 converter_source, module=None, columnar: bool = False, timed: bool = False):
+        """
+        Args:
+            new_table: Name of the new table.
+            field_mappings: Field mappings of the selected columns, in SELECT order.
+            defaults: Default values for fields.
+            functions: Processing function name per new field name.
+            converter_source: Class providing the adapt_<old>_to_<new> converters.
+            module: Imported processing module of the table, if any.
+            columnar: Convert whole batches column by column instead of row by row.
+            timed: Count the calls and time of every converter and processing function.
+        """
+        self.new_table = new_table
+        self.columnar = columnar
+        self.field_mappings = field_mappings
+        self.defaults = defaults
+        self.functions = functions
+
+        # {field name: position}, old and new names, first match wins like get_field_index
+        self.field_index = {}
+        for index, field in enumerate(field_mappings):
+            self.field_index.setdefault(field['field_name_old'], index)
+            self.field_index.setdefault(field['field_name_new'], index)
+        self.id_position = 0
+        for index, field in enumerate(field_mappings):
+            if field['field_name_new'] == 'id':
+                self.id_position = index
+                break
+
+        # (position, converter) for every field whose type changes
+        self.converters = []
+        for index, field in enumerate(field_mappings):
+            old_field_type = field.get('field_type_old')
+            new_field_type = field.get('field_type_new')
+            if old_field_type and new_field_type and old_field_type != new_field_type:
+                data_type = 'adapt_' + old_field_type.lower() + '_to_' + new_field_type.lower()
+                handler_func = getattr(converter_source, data_type, None)
+                if handler_func:
+                    if timed:
+                        handler_func = TimedFunction(handler_func.__qualname__, handler_func)
+                    self.converters.append((index, handler_func))
+                else:
+                    logging.info(f"No handler found for data type: {data_type}")
+
+        # Processing functions bound once, applied in field order
+        self.row_functions = []
+        if module is not None:
+            for field in field_mappings:
+                function_name = functions.get(field['field_name_new'])
+                if not function_name:
+                    continue
+                function = getattr(module, function_name, None)
+                if function is None:
+                    logging.info(f"Error: Can not find function {function_name} in {module.__name__}.")
+                else:
+                    if timed:
+                        function = TimedFunction(f"{module.__name__}.{function_name}", function)
+                    self.row_functions.append(function)
+            if self.row_functions:
+                # Before the row plan the functions of the mapping files were never called
+                logging.info(f"Applying processing functions to {new_table}: "
+                             f"{', '.join(f'{field}={name}' for field, name in functions.items())}")
+
+        # Column order of inserted records: mapped fields, then defaults not mapped.
+        # Each column takes its value from a row position or from its default.
+        self.mapped_columns = list(dict.fromkeys(field['field_name_new'] for field in field_mappings))
+        self.insert_columns = list(self.mapped_columns)
+        last_positions = {field['field_name_new']: index for index, field in enumerate(field_mappings)}
+        self.insert_columns += [column for column in defaults if column not in last_positions]
+        self.insert_sources = [(column in defaults, defaults.get(column, last_positions.get(column)))
+                               for column in self.insert_columns]
+        # Type names of insert_columns when new records are written with binary COPY, set by the loader
+        self.copy_types = None
+
+    def take_timings(self) -> dict:
+        """
+        Returns the calls and time of the converters and processing functions since
+        the last call, as {function name: (calls, seconds)}, empty when not timed.
+        """
+        timings = {}
+        functions = [converter for _, converter in self.converters] + self.row_functions
+        for function in functions:
+            if isinstance(function, TimedFunction):
+                calls, seconds = function.take()
+                if calls:
+                    previous_calls, previous_seconds = timings.get(function.name, (0, 0.0))
+                    timings[function.name] = (previous_calls + calls, previous_seconds + seconds)
+        return timings
+
+    def transform(self, row) -> tuple:
+        """
+        Applies the converters and processing functions to a selected row.
+        Args:
+            row: Row selected from the old table.
+        Returns:
+            The transformed row, in the same column order.
+        """
+        values = list(row)
+        for index, converter in self.converters:
+            value = values[index]
+            if value is not None:
+                values[index] = converter(value)
+        return self.apply_functions(tuple(values))
+
+    def apply_functions(self, row) -> tuple:
+        """
+        Applies the processing functions to a converted row.
+        """
+        for function in self.row_functions:
+            row = function(row, self.field_index)
+        return row
+
+    def transform_batch(self, rows) -> tuple:
+        """
+        Transforms a batch of selected rows, column by column when the plan is
+        columnar. Rows that fail are reported instead of stopping the batch.
+        Args:
+            rows: Rows selected from the old table.
+        Returns:
+            Tuple of the list of transformed rows and the list of failures,
+            as (row, exception class name, exception message, traceback text) tuples.
+        """
+        records = []
+        failures = []
+        pending_rows = rows
+        functions_only = False
+        if self.columnar:
+            try:
+                pending_rows = self.convert_batch(rows)
+                functions_only = True
+            except Exception as e:
+                # Fall back to the row-at-a-time path, which isolates the failing rows
+                logging.info(f"Columnar conversion of {self.new_table} failed, converting row by row: {e}")
+        for index, row in enumerate(pending_rows):
+            try:
+                records.append(self.apply_functions(row) if functions_only else self.transform(row))
+            except Exception as e:
+                failures.append((rows[index], type(e).__name__, str(e), traceback.format_exc()))
+        return records, failures
+
+    def convert_batch(self, rows) -> list:
+        """
+        Applies the converters to a whole batch, one column at a time. The result
+        is identical to converting each row with `transform`, without the functions.
+        Args:
+            rows: Rows selected from the old table.
+        Returns:
+            List of converted rows.
+        """
+        if not self.converters or not rows:
+            return list(rows)
+        columns = list(zip(*rows))
+        for index, converter in self.converters:
+            columns[index] = self.convert_column(columns[index], converter)
+        return list(zip(*columns))
+
+    def convert_column(self, values, converter) -> list:
+        """
+        Converts all values of a column, NULLs left untouched.
+        Integer casts of numeric columns go through NumPy when it is installed and
+        the result is exact, NULLs masked out; other converters are applied once per
+        distinct value, unless most values of the column turn out to be distinct.
+        """
+        if np is not None and converter.__name__ in self.NUMPY_INTEGER_CASTS:
+            column = self.numpy_integer_cast(values)
+            if column is not None:
+                return column
+        converted = {}
+        column = []
+        memoize = True
+        for position, value in enumerate(values):
+            if value is None:
+                column.append(None)
+                continue
+            if not memoize:
+                column.append(converter(value))
+                continue
+            # Keyed on the type as well, 1, 1.0 and True are equal but may convert differently
+            key = (value.__class__, value)
+            try:
+                result = converted[key]
+            except KeyError:
+                result = converted[key] = converter(value)
+            except TypeError:  # Unhashable value
+                result = converter(value)
+            column.append(result)
+            if position == self.MEMO_SAMPLE and len(converted) > self.MEMO_SAMPLE // 2:
+                # Mostly distinct values, looking them up costs more than it saves
+                memoize = False
+        return column
+
+    def numpy_integer_cast(self, values):
+        """
+        Truncates a column of numbers to integers with NumPy, NULLs kept.
+        Returns:
+            The converted column, None when NumPy can not give the exact result of int().
+        """
+        present = [value for value in values if value is not None]
+        if not present:
+            return list(values)
+        array = np.asarray(present)
+        if array.dtype == np.float64:
+            if not np.isfinite(array).all() or np.abs(array).max() >= self.NUMPY_EXACT_LIMIT:
+                return None
+            converted = array.astype(np.int64).tolist()
+        elif array.dtype == np.int64:
+            converted = array.tolist()
+        else:
+            return None
+        if len(present) == len(values):
+            return converted
+        converted = iter(converted)
+        return [None if value is None else next(converted) for value in values]
+
+    def insert_values(self, row) -> list:
+        """
+        Returns the values of a transformed row in `insert_columns` order, defaults applied.
+        """
+        return [source if is_default else row[source] for is_default, source in self.insert_sources]
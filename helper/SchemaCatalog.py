@@ -0,0 +1,44 @@
+class SchemaCatalog:
+    """
+    Tables and columns of a database schema, read with a single information_schema
+    query so every mapping can be checked without touching the tables themselves.
+    """
+
+    def __init__(self, columns: dict):
+        # {table name: {column name: type name (udt_name, e.g. int4, varchar, jsonb)}}
+        self.columns = columns
+
+    @classmethod
+    def load(cls, conn, schema: str = 'public'):
+        """
+        Reads the columns of every table of a schema.
+        Args:
+            conn: Connection to the database.
+            schema: Name of the schema.
+        Returns:
+            SchemaCatalog of the schema.
+        """
+        columns = {}
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT table_name, column_name, udt_name FROM information_schema.columns "
+                           "WHERE table_schema = %s ORDER BY table_name, ordinal_position", (schema,))
+            for table, column, type_name in cursor.fetchall():
+                columns.setdefault(table, {})[column] = type_name
+        conn.commit()
+        return cls(columns)
+
+    def has_table(self, table: str) -> bool:
+        return table in self.columns
+
+    def column_type(self, table: str, column: str):
+        """
+        Returns the type name of a column, None when the column does not exist.
+        """
+        return self.columns.get(table, {}).get(column)
+
+    def missing_columns(self, table: str, columns) -> list:
+        """
+        Returns the given columns that do not exist in the table, in their original order.
+        """
+        table_columns = self.columns.get(table, {})
+        return [column for column in columns if column not in table_columns]
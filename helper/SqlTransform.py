@@ -0,0 +1,71 @@
+import re
+
+
+class SqlTransform:
+    """
+    Declarative transformations of a mapped field, compiled into a SQL expression
+    of the SELECT reading the old table, so the old database does the work and the
+    column goes through the loader untouched. Written as elements of the <field>:
+
+        <value_map><value old="digital">service</value></value_map>
+            replaces listed values, other values are kept
+        <coalesce>1999-01-01</coalesce>
+            replaces NULL with the value
+        <cast>numeric</cast>
+            casts to a PostgreSQL type
+        <translate>en_US nl_NL</translate>
+            builds the {"en_US": value, "nl_NL": value} JSON of translated fields
+
+    They are applied in this order, whatever their order in the file.
+    """
+
+    ELEMENTS = ('value_map', 'coalesce', 'cast', 'translate')
+    TYPE_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_ ]*(\(\d+(,\s*\d+)?\))?(\[\])?$')
+    LANGUAGE = re.compile(r'^[A-Za-z]{2,3}(_[A-Za-z0-9]+)?$')
+
+    @staticmethod
+    def literal(value: str) -> str:
+        return "'" + value.replace("'", "''") + "'"
+
+    @classmethod
+    def compile(cls, field_element, column: str):
+        """
+        Compiles the transformations of a <field> element.
+        Args:
+            field_element: The <field> element of the mapping file.
+            column: Name of the old column.
+        Returns:
+            The SQL expression, None when the field has no transformation.
+        Raises:
+            ValueError: When a transformation is malformed.
+        """
+        expression = column
+        value_map = field_element.find('value_map')
+        if value_map is not None:
+            cases = []
+            for value in value_map.findall('value'):
+                if value.get('old') is None:
+                    raise ValueError(f"<value> of {column} without old attribute")
+                cases.append(f"WHEN {cls.literal(value.get('old'))} THEN {cls.literal(value.text or '')}")
+            if cases:
+                expression = f"CASE {expression} {' '.join(cases)} ELSE {expression} END"
+        coalesce = field_element.find('coalesce')
+        if coalesce is not None:
+            if coalesce.text is None:
+                raise ValueError(f"<coalesce> of {column} without value")
+            expression = f"COALESCE({expression}, {cls.literal(coalesce.text)})"
+        cast = field_element.find('cast')
+        if cast is not None:
+            type_name = (cast.text or '').strip()
+            if not cls.TYPE_NAME.match(type_name):
+                raise ValueError(f"Invalid <cast> type of {column}: {type_name!r}")
+            expression = f"({expression})::{type_name}"
+        translate = field_element.find('translate')
+        if translate is not None:
+            languages = (translate.text or '').split()
+            if not languages or not all(cls.LANGUAGE.match(language) for language in languages):
+                raise ValueError(f"Invalid <translate> languages of {column}: {translate.text!r}")
+            pairs = ', '.join(f"{cls.literal(language)}, {expression}" for language in languages)
+            # As text, the loader writes it like the JSON strings built by the processing functions
+            expression = f"jsonb_build_object({pairs})::text"
+        return expression if expression != column else None
@@ -0,0 +1,126 @@
+import zlib
+
+
+class StagingTable:
+    """
+    UNLOGGED copy of the columns a mapping writes, loaded instead of the target table
+    and merged into it at the end with set-based statements in a single transaction.
+    The merge gives the same result as the upsert load mode: new records get their
+    defaults, existing records only get their mapped fields overwritten. Mapped columns
+    that also have a default are staged twice, the second copy holding the mapped value.
+    """
+
+    PREFIX = 'migration_stage_'
+
+    def __init__(self, plan, mapping_key: str):
+        """
+        Args:
+            plan: RowPlan of the mapping.
+            mapping_key: Key of the mapping, or of its partition, the staging table is unique to it.
+        """
+        self.plan = plan
+        self.name = f"{self.PREFIX}{zlib.crc32(mapping_key.encode()):08x}_{plan.new_table}"[:63]
+        positions = {field['field_name_new']: index for index, field in enumerate(plan.field_mappings)}
+        self.overridden_columns = [column for column in plan.mapped_columns
+                                   if column != 'id' and column in plan.defaults]
+        self.overridden_positions = [positions[column] for column in self.overridden_columns]
+        self.columns = plan.insert_columns + [f"{column}__mapped" for column in self.overridden_columns]
+        self.copy_types = None
+        if plan.copy_types is not None:
+            column_types = dict(zip(plan.insert_columns, plan.copy_types))
+            self.copy_types = plan.copy_types + [column_types[column] for column in self.overridden_columns]
+
+    def values(self, row) -> list:
+        """
+        Returns the values of a transformed row in `columns` order.
+        """
+        return self.plan.insert_values(row) + [row[position] for position in self.overridden_positions]
+
+    def create(self, cursor, keep: bool = False):
+        """
+        Creates the staging table with the columns, defaults, NOT NULL and CHECK constraints
+        of the target (no unique or foreign key), so the batches loaded into it fail on the
+        same rows as the target would.
+        Args:
+            cursor: Cursor for the new database.
+            keep: Keep the rows of an existing staging table, when resuming the mapping.
+        """
+        if not keep:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.name}")
+        cursor.execute("SELECT to_regclass(%s)", (self.name,))
+        if cursor.fetchone()[0] is not None:
+            return
+        table = self.plan.new_table
+        cursor.execute(f"CREATE UNLOGGED TABLE {self.name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        # Columns the mapping does not write are dropped along with their constraints, they
+        # keep their value in existing records and get their own default in new ones
+        cursor.execute("SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+                       "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped", (table,))
+        column_types = dict(cursor.fetchall())
+        dropped = [column for column in column_types if column not in self.plan.insert_columns]
+        added = [f"{column}__mapped {column_types[column]}" for column in self.overridden_columns]
+        if dropped or added:
+            cursor.execute(f"ALTER TABLE {self.name} "
+                           + ', '.join([f"DROP COLUMN {column}" for column in dropped]
+                                       + [f"ADD COLUMN {column}" for column in added]))
+
+    def id_bounds(self, cursor):
+        """
+        Returns the lowest and highest staged id, None when nothing is staged.
+        """
+        cursor.execute(f"SELECT min(id), max(id) FROM {self.name}")
+        lowest, highest = cursor.fetchone()
+        return None if lowest is None else (lowest, highest)
+
+    def discard(self, cursor, record_id) -> int:
+        """
+        Removes the staged rows of a record that can not be merged.
+        Returns:
+            Number of rows removed.
+        """
+        cursor.execute(f"DELETE FROM {self.name} WHERE id = %s", (record_id,))
+        return cursor.rowcount
+
+    def merge(self, cursor, lower=None, upper=None) -> int:
+        """
+        Merges the staged rows into the target table, without committing. A row staged
+        twice is merged once, with its last values.
+        Args:
+            cursor: Cursor for the new database.
+            lower: Optional inclusive lower bound of the ids merged.
+            upper: Optional exclusive upper bound of the ids merged.
+        Returns:
+            Number of rows inserted or updated.
+        """
+        table = self.plan.new_table
+        columns = self.plan.insert_columns
+        if 'id' not in columns:
+            cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {self.name}")
+            return cursor.rowcount
+        conditions, params = [], []
+        if lower is not None:
+            conditions.append("id >= %s")
+            params.append(lower)
+        if upper is not None:
+            conditions.append("id < %s")
+            params.append(upper)
+        where_clause = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        staged = f"SELECT DISTINCT ON (id) * FROM {self.name}{where_clause} ORDER BY id, ctid DESC"
+        if self.overridden_columns:
+            # Existing records first, the INSERT below leaves these columns alone
+            cursor.execute(f"UPDATE {table} SET "
+                           + ', '.join(f"{column} = staged.{column}__mapped" for column in self.overridden_columns)
+                           + f" FROM ({staged}) AS staged WHERE {table}.id = staged.id", params)
+        update_columns = [column for column in self.plan.mapped_columns
+                          if column != 'id' and column not in self.plan.defaults]
+        if update_columns:
+            conflict_action = "DO UPDATE SET " + ', '.join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+        else:
+            conflict_action = "DO NOTHING"
+        cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) "
+                       f"SELECT {', '.join(columns)} FROM ({staged}) AS staged ON CONFLICT (id) {conflict_action}",
+                       params)
+        return cursor.rowcount
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE {self.name}")
@@ -0,0 +1,94 @@
+import logging
+from datetime import timedelta
+
+
+class WatermarkJournal:
+    """
+    High-water marks of the delta migration, kept in a side table of the new database.
+    The mark of a mapping is the greatest (write_date, id) of its old table when its
+    last successful run started; the next run only reads rows modified after it.
+    Rows without write_date can not be ordered by it, the mark also keeps the greatest
+    id among them and the next run reads the ones created since.
+    """
+
+    TABLE = 'migration_watermark'
+    COLUMN = 'write_date'
+
+    def ensure_table(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                    mapping_key varchar PRIMARY KEY,
+                    write_date timestamp NOT NULL,
+                    last_id bigint NOT NULL,
+                    null_last_id bigint,
+                    updated_at timestamp NOT NULL DEFAULT now()
+                )
+            """)
+            cursor.execute(f"ALTER TABLE {self.TABLE} ADD COLUMN IF NOT EXISTS null_last_id bigint")
+        conn.commit()
+
+    def load(self, cursor, mapping_key: str):
+        """
+        Returns the (write_date, id, id without write_date) mark of a mapping, None when it
+        was never migrated in delta mode. Marks stored without the last id of the rows
+        without write_date give 0, so all these rows are read once.
+        """
+        cursor.execute(f"SELECT write_date, last_id, COALESCE(null_last_id, 0) FROM {self.TABLE} "
+                       f"WHERE mapping_key = %s", (mapping_key,))
+        return cursor.fetchone()
+
+    def current(self, old_db_conn, old_table: str, id_field: str):
+        """
+        Returns the greatest (write_date, id) of an old table with the greatest id of its
+        rows without write_date (0 when there is none), None when no row has a write_date.
+        """
+        with old_db_conn.cursor() as cursor:
+            cursor.execute(f"SELECT {self.COLUMN}, {id_field} FROM {old_table} WHERE {self.COLUMN} IS NOT NULL "
+                           f"ORDER BY {self.COLUMN} DESC, {id_field} DESC LIMIT 1")
+            mark = cursor.fetchone()
+            if mark is not None:
+                cursor.execute(f"SELECT COALESCE(max({id_field}), 0), count(*) FROM {old_table} "
+                               f"WHERE {self.COLUMN} IS NULL")
+                null_last_id, null_rows = cursor.fetchone()
+                if null_rows:
+                    logging.info(f"{null_rows} rows of {old_table} have no {self.COLUMN}, "
+                                 f"rows without it are selected by id")
+                mark = (mark[0], mark[1], null_last_id)
+        old_db_conn.rollback()
+        return mark
+
+    def conditions(self, mark, id_field: str, overlap: float = 0.0):
+        """
+        Builds the condition selecting the rows modified after a mark, and the rows without
+        write_date created after it. The plain comparison on write_date lets an index on
+        write_date alone be used (both branches, combined with a BitmapOr), the row
+        comparison skips the rows of the mark's own timestamp already migrated.
+        Args:
+            mark: (write_date, id, id without write_date) of the last run.
+            id_field: Name of the id column in the old table.
+            overlap: Seconds read again before the mark, for transactions committed late.
+        Returns:
+            Tuple of the list of SQL conditions and the list of their parameters.
+        """
+        write_date, last_id, null_last_id = mark
+        without_write_date = f"({self.COLUMN} IS NULL AND {id_field} > %s)"
+        if overlap:
+            return ([f"({self.COLUMN} >= %s OR {without_write_date})"],
+                    [write_date - timedelta(seconds=overlap), null_last_id])
+        return ([f"(({self.COLUMN} >= %s AND ({self.COLUMN}, {id_field}) > (%s, %s)) OR {without_write_date})"],
+                [write_date, write_date, last_id, null_last_id])
+
+    def record(self, cursor, mapping_key: str, mark):
+        """
+        Writes the mark of a mapping, the caller commits it.
+        """
+        cursor.execute(f"""
+            INSERT INTO {self.TABLE} (mapping_key, write_date, last_id, null_last_id, updated_at)
+            VALUES (%s, %s, %s, %s, now())
+            ON CONFLICT (mapping_key) DO UPDATE SET
+                write_date = EXCLUDED.write_date,
+                last_id = EXCLUDED.last_id,
+                null_last_id = EXCLUDED.null_last_id,
+                updated_at = EXCLUDED.updated_at
+        """, (mapping_key, mark[0], mark[1], mark[2]))
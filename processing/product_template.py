@@ -1,44 +1,7 @@
-import json
-
 def get_field_index(field_mappings, field_name):
+    if isinstance(field_mappings, dict):  # {field name: index} compiled by the loader
+        return field_mappings.get(field_name)
     for i, field in enumerate(field_mappings):
         if field_name in field:
             return i
     return None  # Field name not found in field_mappings
-
-
-def process_name(row, field_mappings):
-    return addTranslation(row, field_mappings, 'name')
-
-
-def process_description_sale(row, field_mappings):
-    return addTranslation(row, field_mappings, 'description_sale')
-
-def process_type(row, field_mappings):
-    indexType = get_field_index(field_mappings, 'type')
-    row_list = list(row)
-    typeValue = row_list[indexType]
-    if typeValue == 'digital':
-        row_list[indexType] = 'service'
-    row = tuple(row_list)
-    return row
-
-def process_detailed_type(row, field_mappings):
-    indexType = get_field_index(field_mappings, 'detailed_type')
-    row_list = list(row)
-    typeValue = row_list[indexType]
-    if typeValue == 'digital':
-        row_list[indexType] = 'service'
-    row = tuple(row_list)
-    return row
-
-def addTranslation(row, field_mappings, field):
-    indexName = get_field_index(field_mappings, field)
-    row_list = list(row)  # Convert tuple to list
-    name = {
-        "en_US" : row_list[indexName],
-        "nl_NL" : row_list[indexName]
-    }
-    row_list[indexName] = json.dumps(name)
-    row = tuple(row_list)  # Convert list back to tuple
-    return row
\ No newline at end of file
@@ -1,4 +1,6 @@
 def get_field_index(field_mappings, field_name):
+    if isinstance(field_mappings, dict):  # {field name: index} compiled by the loader
+        return field_mappings.get(field_name)
     for i, field in enumerate(field_mappings):
         if field_name in field:
             return i
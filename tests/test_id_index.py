@@ -0,0 +1,65 @@
+import random
+import unittest
+from array import array
+
+from helper.IdIndex import IdIndex
+
+
+class IdIndexTest(unittest.TestCase):
+
+    def assert_holds(self, index, ids):
+        self.assertEqual(len(index), len(ids))
+        for record_id in ids:
+            self.assertIn(record_id, index)
+
+    def test_pending_id_inside_grown_bitmap(self):
+        index = IdIndex(array('q', range(1, 11)))
+        index.add(1000)  # Beyond the bitmap, kept pending
+        index.add_many(range(11, 30))
+        index.add(1500)  # Grows the bitmap over 1000
+        self.assertIn(1000, index)
+        self.assert_holds(index, list(range(1, 30)) + [1000, 1500])
+        self.assertNotIn(999, index)
+
+    def test_random_adds(self):
+        generator = random.Random(7)
+        for sorted_ids, id_range in ((array('q', range(1, 11)), 5000), (array('q'), 10 ** 9),
+                                     (array('q', range(0, 10 ** 6, 997)), 10 ** 6)):
+            index = IdIndex(sorted_ids, merge_threshold=50)
+            ids = set(sorted_ids)
+            for _ in range(3000):
+                record_id = generator.randrange(id_range)
+                index.add(record_id)
+                ids.add(record_id)
+            self.assert_holds(index, ids)
+            for record_id in generator.sample(range(id_range), 1000):
+                self.assertEqual(record_id in index, record_id in ids)
+
+    def test_ascending_ids_stay_in_one_run(self):
+        index = IdIndex(merge_threshold=100)
+        index.add_many(range(0, 100000, 100))
+        self.assertIsNone(index.bitmap)
+        self.assertEqual(len(index.runs), 1)
+        self.assert_holds(index, range(0, 100000, 100))
+
+    def test_dense_ids_switch_to_bitmap(self):
+        index = IdIndex(merge_threshold=100)
+        index.add_many(range(1, 1001))
+        self.assertIsNotNone(index.bitmap)
+        self.assert_holds(index, range(1, 1001))
+
+    def test_merge_runs(self):
+        merged = IdIndex.merge_runs(array('q', [1, 4, 6, 9]), array('q', [0, 5, 10]))
+        self.assertEqual(list(merged), [0, 1, 4, 5, 6, 9, 10])
+        self.assertIsInstance(merged, array)
+
+    def test_none_and_duplicates(self):
+        index = IdIndex()
+        index.add(None)
+        index.add_many([3, 3, 2])
+        self.assertNotIn(None, index)
+        self.assertEqual(len(index), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()